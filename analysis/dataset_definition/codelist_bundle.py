@@ -0,0 +1,142 @@
+# Compiled codelist bundle
+#
+# Parsed codelists are stored in a single JSON bundle (lib/codelists_bundle.json),
+# keyed by (file, column, category_column). Each entry records the SHA-256 of the CSV's
+# bytes when it was built, and is used without parsing the CSV while the CSV still has
+# that hash. Otherwise the CSV is parsed with ehrQL's codelist_from_csv. The hash only
+# depends on the file's contents, so a clean checkout can use a committed bundle.
+#
+# Build (or refresh) the bundle from the repository root, with ehrQL installed, with:
+#   python analysis/dataset_definition/codelist_bundle.py
+# Only stale or missing entries are re-parsed, and entries for codelists that are
+# no longer defined in codelists.py are dropped. Commit lib/codelists_bundle.json
+# afterwards, as for lib/active_analyses.rds.
+#
+# The check_codelist_bundle action runs
+#   python analysis/dataset_definition/codelist_bundle.py --check
+# which fails if the bundle is missing, or any codelist in codelists.py is missing from
+# it or stale, so an out-of-date bundle is caught before the dataset definitions run.
+
+import argparse
+import hashlib
+import json
+import os
+
+bundle_path = "lib/codelists_bundle.json"
+bundle_version = 3
+
+_entries = None  # entries read from the bundle
+_stale = {}  # entries parsed from CSV in this process because the bundle was out of date
+_loaded = set()  # keys of every codelist loaded in this process
+
+def read_bundle(path=bundle_path):
+    try:
+        with open(path) as f:
+            bundle = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(bundle, dict) or bundle.get("version") != bundle_version:
+        return {}
+    return {
+        (entry["filename"], entry["column"], entry["category_column"]): entry
+        for entry in bundle["entries"]
+    }
+
+def _get_entries():
+    global _entries
+    if _entries is None:
+        _entries = read_bundle()
+    return _entries
+
+# What an entry is checked against: the SHA-256 of the CSV's bytes
+
+def file_state(filename):
+    with open(filename, "rb") as f:
+        return dict(sha256=hashlib.sha256(f.read()).hexdigest())
+
+def is_current(entry, state):
+    return entry is not None and entry.get("sha256") == state["sha256"]
+
+# Drop-in replacement for codelist_from_csv that reads from the bundle when it is up to date
+
+def load_codelist(filename, *, column, category_column=None):
+    key = (filename, column, category_column)
+    _loaded.add(key)
+    state = file_state(filename)
+
+    entry = _stale.get(key) or _get_entries().get(key)
+    if is_current(entry, state):
+        codelist = entry["codelist"]
+    else:
+        from ehrql import codelist_from_csv  # imported here so the bundle can be read without ehrQL
+        codelist = codelist_from_csv(filename, column=column, category_column=category_column)
+        _stale[key] = dict(
+            filename=filename, column=column, category_column=category_column,
+            **state, codelist=dict(codelist) if isinstance(codelist, dict) else list(codelist),
+        )
+
+    # Return a copy so that callers cannot modify the cached codelist
+    return dict(codelist) if isinstance(codelist, dict) else list(codelist)
+
+# Keys of the codelists that had to be parsed from CSV
+
+def stale_codelists():
+    return sorted(_stale, key=str)
+
+# Write the bundle, keeping only the codelists loaded in this process
+
+def write_bundle(path=bundle_path):
+    entries = _get_entries()
+    bundle = dict(
+        version=bundle_version,
+        entries=[_stale.get(key) or entries[key] for key in sorted(_loaded, key=str)],
+    )
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(bundle, f)
+    os.replace(tmp_path, path)
+
+# Problems with the bundle for the given codelist specs (see codelists.py), without parsing any CSV
+
+def check_bundle(specs, path=bundle_path):
+    if not os.path.exists(path):
+        return [f"{path} does not exist"]
+    entries = read_bundle(path)
+    if not entries:
+        return [f"{path} is not a version {bundle_version} bundle"]
+    problems = []
+    for name, spec in specs.items():
+        key = (spec["filename"], spec["column"], spec["category_column"])
+        if key not in entries:
+            problems.append(f"{name}: {spec['filename']} is missing from the bundle")
+        elif not is_current(entries[key], file_state(spec["filename"])):
+            problems.append(f"{name}: {spec['filename']} has changed since the bundle was built")
+    return problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or check the compiled codelist bundle")
+    parser.add_argument("--check", action="store_true", help="fail if the bundle is missing or stale")
+    parser.add_argument("--output", default=None, help="with --check, also write the result to this file")
+    args = parser.parse_args()
+
+    import codelist_bundle  # the module instance used by codelists.py
+    import codelists
+
+    if args.check:
+        problems = check_bundle(codelists.codelist_specs)
+        report = "\n".join(problems) if problems else f"{bundle_path} is up to date for {len(codelists.codelist_specs)} codelists"
+        print(report)
+        if args.output:
+            os.makedirs(os.path.dirname(args.output), exist_ok=True)
+            with open(args.output, "w") as f:
+                f.write(report + "\n")
+        if problems:
+            raise SystemExit(f"{bundle_path} is missing or stale: rebuild it with python analysis/dataset_definition/codelist_bundle.py")
+    else:
+        for name in codelists.codelist_specs:
+            getattr(codelists, name)
+
+        for filename, column, category_column in codelist_bundle.stale_codelists():
+            print(f"Rebuilt {filename} (column={column}, category_column={category_column})")
+        codelist_bundle.write_bundle()
+        print(f"Wrote {len(codelist_bundle._loaded)} codelists to {bundle_path}")
@@ -0,0 +1,65 @@
+# Report which codelists each dataset definition loads and how long each one took
+#
+# Usage (from the repository root, with ehrQL installed):
+#   python analysis/dataset_definition/codelist_report.py [<dataset definition> ...]
+#
+# Each dataset definition is loaded in its own process, so that the report only
+# contains the codelists that definition references (see codelists.py).
+# The report is written to output/dataset_definition/codelist_report.json.
+
+import json
+import os
+import runpy
+import subprocess
+import sys
+
+definitions = [
+    "analysis/dataset_definition/dataset_definition_dates.py",
+    # dataset_definition_cohorts.py only defines generate_dataset, so report it through a cohort
+    "analysis/dataset_definition/dataset_definition_prevax.py",
+]
+
+output_path = "output/dataset_definition/codelist_report.json"
+
+# Load a dataset definition and return the codelists it loaded
+
+def report_definition(definition):
+    sys.path.insert(0, os.path.dirname(definition))
+    runpy.run_path(definition)
+    import codelists
+    return codelists.codelist_report()
+
+def codelist_report(definitions=definitions):
+    report = {}
+    for definition in definitions:
+        result = subprocess.run(
+            [sys.executable, __file__, "--definition", definition],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        loaded = json.loads(result.stdout.splitlines()[-1])
+        report[definition] = dict(
+            codelists=len(loaded),
+            codes=sum(c["codes"] for c in loaded),
+            load_seconds=round(sum(c["load_seconds"] for c in loaded), 6),
+            loaded=sorted(loaded, key=lambda c: c["load_seconds"], reverse=True),
+        )
+    return report
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["--definition"]:
+        print(json.dumps(report_definition(args[1])))
+        sys.exit()
+
+    report = codelist_report(args or definitions)
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for definition, summary in report.items():
+        print(f"{definition}: {summary['codelists']} codelists, {summary['codes']} codes, {summary['load_seconds']:.3f}s")
+        for c in summary["loaded"]:
+            print(f"    {c['name']:<40} {c['codes']:>7} codes  {c['load_seconds']:.4f}s")
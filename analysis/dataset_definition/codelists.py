@@ -1,459 +1,503 @@
 # Setup
-from ehrql import codelist_from_csv
+# Codelists are read from the compiled bundle (see codelist_bundle.py), falling back to the CSVs
+from codelist_bundle import load_codelist
+
+import time
+
+# Codelists are loaded lazily: each one is only read when it is first imported,
+# e.g. `from codelists import ast_primis`, so a dataset definition only pays for
+# the codelists it references. (`from codelists import *` still loads them all.)
+
+def codelist_spec(filename, *, column, category_column=None):
+    return dict(filename=filename, column=column, category_column=category_column)
+
+codelist_specs = dict(
 
 # Exposure(s)
 
 # Covid
-covid_codes = codelist_from_csv(
+covid_codes = codelist_spec(
     "codelists/user-RochelleKnight-confirmed-hospitalised-covid-19.csv",
     column="code"
-)
+),
 
-covid_primary_care_positive_test = codelist_from_csv(
+covid_primary_care_positive_test = codelist_spec(
     "codelists/opensafely-covid-identification-in-primary-care-probable-covid-positive-test.csv",
     column="CTV3ID"
-)
+),
 
-covid_primary_care_code = codelist_from_csv(
+covid_primary_care_code = codelist_spec(
     "codelists/opensafely-covid-identification-in-primary-care-probable-covid-clinical-code.csv",
     column="CTV3ID"
-)
+),
 
-covid_primary_care_sequalae = codelist_from_csv(
+covid_primary_care_sequalae = codelist_spec(
     "codelists/opensafely-covid-identification-in-primary-care-probable-covid-sequelae.csv",
     column="CTV3ID"
-)
+),
 
 # Common covariate(s)
 
 # Ethnicity
-ethnicity_snomed = codelist_from_csv(
+ethnicity_snomed = codelist_spec(
     "codelists/opensafely-ethnicity-snomed-0removed.csv",
     column="code",
     category_column="Grouping_6"
-)
+),
 
-# primis_covid19_vacc_update_ethnicity = codelist_from_csv(
+# primis_covid19_vacc_update_ethnicity = codelist_spec(
 #     "codelists/primis-covid19-vacc-uptake-eth2001.csv",
 #     column="code",
 #     category_column="grouping_6_id"
-# )
+# ),
 
 # Smoking
-smoking_clear = codelist_from_csv(
+smoking_clear = codelist_spec(
     "codelists/opensafely-smoking-clear.csv",
     column="CTV3Code",
     category_column="Category"
-)
+),
 
-# smoking_unclear = codelist_from_csv(
+# smoking_unclear = codelist_spec(
 #     "codelists/opensafely-smoking-unclear.csv",
 #     column="CTV3Code",
 #     category_column="Category"
-# )
+# ),
 
-# ever_current_smoke = codelist_from_csv(
+# ever_current_smoke = codelist_spec(
 #     "codelists/bristol-smoke-and-eversmoke.csv",
 #     column="code"
-# )
+# ),
 
 # BMI
-bmi_obesity_snomed = codelist_from_csv(
+bmi_obesity_snomed = codelist_spec(
     "codelists/user-elsie_horne-bmi_obesity_snomed.csv",
     column="code"
-)
+),
 
-bmi_obesity_icd10 = codelist_from_csv(
+bmi_obesity_icd10 = codelist_spec(
     "codelists/user-elsie_horne-bmi_obesity_icd10.csv",
     column="code"
-)
+),
 
-bmi_primis = codelist_from_csv(
+bmi_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-bmi.csv",
     column="code"
-)
+),
 
 # Total Cholesterol
-cholesterol_snomed = codelist_from_csv(
+cholesterol_snomed = codelist_spec(
     "codelists/opensafely-cholesterol-tests-numerical-value.csv",
     column="code"
-)
+),
 
 # HDL Cholesterol
-hdl_cholesterol_snomed = codelist_from_csv(
+hdl_cholesterol_snomed = codelist_spec(
     "codelists/bristol-hdl-cholesterol.csv",
     column="code"
-)
+),
 
 # Carer codes
-# carer_primis = codelist_from_csv(
+# carer_primis = codelist_spec(
 #     "codelists/primis-covid19-vacc-uptake-carer.csv",
 #     column="code"
-# )
+# ),
 
 # No longer a carer codes
-# notcarer_primis = codelist_from_csv(
+# notcarer_primis = codelist_spec(
 #     "codelists/primis-covid19-vacc-uptake-notcarer.csv",
 #     column="code"
-# )
+# ),
 
 # Wider Learning Disability
-learndis_primis = codelist_from_csv(
+learndis_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-learndis.csv",
     column="code"
-)
+),
 
 # Employed by Care Home codes
-# carehome_primis = codelist_from_csv(
+# carehome_primis = codelist_spec(
 #     "codelists/primis-covid19-vacc-uptake-carehome.csv",
 #     column="code"
-# )
+# ),
 
 # Employed by nursing home codes
-# nursehome_primis = codelist_from_csv(
+# nursehome_primis = codelist_spec(
 #     "codelists/primis-covid19-vacc-uptake-nursehome.csv",
 #     column="code"
-# )
+# ),
 
 # Employed by domiciliary care provider codes
-# domcare_primis = codelist_from_csv(
+# domcare_primis = codelist_spec(
 #     "codelists/primis-covid19-vacc-uptake-domcare.csv",
 #     column="code"
-# )
+# ),
 
 # Patients in long-stay nursing and residential care
-longres_primis = codelist_from_csv(
+longres_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-longres.csv",
     column="code"
-)
+),
 
 # High Risk from COVID-19 code
-shield_primis = codelist_from_csv(
+shield_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-shield.csv",
     column="code"
-)
+),
 
 # Lower Risk from COVID-19 codes
-nonshield_primis = codelist_from_csv(
+nonshield_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-nonshield.csv",
     column="code"
-)
+),
 
 # For JCVI groups
 
 ## Pregnancy codes
-preg_primis = codelist_from_csv(
+preg_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-preg.csv",
     column="code"
-)
+),
 
 ## Pregnancy or Delivery codes
-pregdel_primis = codelist_from_csv(
+pregdel_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-pregdel.csv",
     column="code"
-)
+),
 
 ## All BMI coded terms
-bmi_stage_primis = codelist_from_csv(
+bmi_stage_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-bmi_stage.csv",
     column="code"
-)
+),
 
 ## Severe Obesity code recorded
-sev_obesity_primis = codelist_from_csv(
+sev_obesity_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-sev_obesity.csv",
     column="code"
-)
+),
 
 ## Asthma Diagnosis code
-ast_primis = codelist_from_csv(
+ast_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-ast.csv",
     column="code"
-)
+),
 
 ## Asthma Admission codes
-astadm_primis = codelist_from_csv(
+astadm_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-astadm.csv",
     column="code"
-)
+),
 
 ## Asthma systemic steroid prescription codes
-astrx_primis = codelist_from_csv(
+astrx_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-astrx.csv",
     column="code"
-)
+),
 
 ## Chronic Respiratory Disease
-resp_primis = codelist_from_csv(
+resp_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-resp_cov.csv",
     column="code"
-)
+),
 
 ## Chronic Neurological Disease including Significant Learning Disorder
-cns_primis = codelist_from_csv(
+cns_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-cns_cov.csv",
     column="code"
-)
+),
 
 ## Asplenia or Dysfunction of the Spleen codes
-spln_primis = codelist_from_csv(
+spln_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-spln_cov.csv",
     column="code"
-)
+),
 
 ## Diabetes diagnosis codes
-diab_primis = codelist_from_csv(
+diab_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-diab.csv",
     column="code"
-)
+),
 
 ## Diabetes resolved codes
-dmres_primis = codelist_from_csv(
+dmres_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-dmres.csv",
     column="code"
-)
+),
 
 ## Severe Mental Illness codes
-sev_mental_primis = codelist_from_csv(
+sev_mental_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-sev_mental.csv",
     column="code"
-)
+),
 
 ## Remission codes relating to Severe Mental Illness
-smhres_primis = codelist_from_csv(
+smhres_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-smhres.csv",
     column="code"
-)
+),
 
 ## Chronic heart disease codes
-chd_primis = codelist_from_csv(
+chd_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-chd_cov.csv",
     column="code"
-)
+),
 
 ## Chronic kidney disease diagnostic codes
-ckd_primis = codelist_from_csv(
+ckd_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-ckd_cov.csv",
     column="code"
-)
+),
 
 ## Chronic kidney disease codes - all stages
-ckd15_primis = codelist_from_csv(
+ckd15_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-ckd15.csv",
     column="code"
-)
+),
 
 ## Chronic kidney disease codes-stages 3 - 5
-ckd35_primis = codelist_from_csv(
+ckd35_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-ckd35.csv",
     column="code"
-)
+),
 
 ## Chronic Liver disease codes
-cld_primis = codelist_from_csv(
+cld_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-cld.csv",
     column="code"
-)
+),
 
 ## Immunosuppression diagnosis codes
-immdx_primis = codelist_from_csv(
+immdx_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-immdx_cov.csv",
     column="code"
-)
+),
 
 ## Immunosuppression medication codes
-immrx_primis = codelist_from_csv(
+immrx_primis = codelist_spec(
     "codelists/primis-covid19-vacc-uptake-immrx.csv",
     column="code"
-)
+),
 
 # Stroke Ischaemic (Ischaemic Stroke)
-stroke_isch_snomed = codelist_from_csv(
+stroke_isch_snomed = codelist_spec(
     "codelists/user-elsie_horne-stroke_isch_snomed.csv",
     column="code"
-)
+),
 
-stroke_isch_icd10 = codelist_from_csv(
+stroke_isch_icd10 = codelist_spec(
     "codelists/user-RochelleKnight-stroke_isch_icd10.csv",
     column="code"
-)
+),
 
 # Dementia
-dementia_snomed = codelist_from_csv(
+dementia_snomed = codelist_spec(
     "codelists/user-elsie_horne-dementia_snomed.csv",
     column="code"
-)
+),
 
-dementia_icd10 = codelist_from_csv(
+dementia_icd10 = codelist_spec(
     "codelists/user-elsie_horne-dementia_icd10.csv",
     column="code"
-)
+),
 
-dementia_vascular_snomed = codelist_from_csv(
+dementia_vascular_snomed = codelist_spec(
     "codelists/user-elsie_horne-dementia_vascular_snomed.csv",
     column="code"
-)
+),
 
-dementia_vascular_icd10 = codelist_from_csv(
+dementia_vascular_icd10 = codelist_spec(
     "codelists/user-elsie_horne-dementia_vascular_icd10.csv",
     column="code"
-)
+),
 
 # Liver disease
-liver_disease_snomed = codelist_from_csv(
+liver_disease_snomed = codelist_spec(
     "codelists/user-elsie_horne-liver_disease_snomed.csv",
     column="code"
-)
+),
 
-liver_disease_icd10 = codelist_from_csv(
+liver_disease_icd10 = codelist_spec(
     "codelists/user-elsie_horne-liver_disease_icd10.csv",
     column="code"
-)
+),
 
 # Chronic Kidney disease
-ckd_snomed = codelist_from_csv(
+ckd_snomed = codelist_spec(
     "codelists/user-elsie_horne-ckd_snomed.csv",
     column="code"
-)
+),
 
-ckd_icd10 = codelist_from_csv(
+ckd_icd10 = codelist_spec(
     "codelists/user-elsie_horne-ckd_icd10.csv",
     column="code"
-)
+),
 
 # Cancer
-cancer_snomed = codelist_from_csv(
+cancer_snomed = codelist_spec(
     "codelists/user-elsie_horne-cancer_snomed.csv",
     column="code"
-)
+),
 
-cancer_icd10 = codelist_from_csv(
+cancer_icd10 = codelist_spec(
     "codelists/user-elsie_horne-cancer_icd10.csv",
     column="code"
-)
+),
 
 # Hypertension
-hypertension_icd10 = codelist_from_csv(
+hypertension_icd10 = codelist_spec(
     "codelists/user-elsie_horne-hypertension_icd10.csv",
     column="code"
-)
-hypertension_drugs_dmd = codelist_from_csv(
+),
+hypertension_drugs_dmd = codelist_spec(
     "codelists/user-elsie_horne-hypertension_drugs_dmd.csv",
     column="dmd_id"
-)
-hypertension_snomed = codelist_from_csv(
+),
+hypertension_snomed = codelist_spec(
     "codelists/nhsd-primary-care-domain-refsets-hyp_cod.csv",
     column="code"
-)
+),
 
 # Diabetes
-diabetes_icd10 = codelist_from_csv(
+diabetes_icd10 = codelist_spec(
     "codelists/user-elsie_horne-diabetes_icd10.csv",
     column="code"
-)
+),
 
-diabetes_drugs_dmd = codelist_from_csv(
+diabetes_drugs_dmd = codelist_spec(
     "codelists/user-elsie_horne-diabetes_drugs_dmd.csv",
     column="dmd_id"
-)
+),
 
-diabetes_snomed = codelist_from_csv(
+diabetes_snomed = codelist_spec(
     "codelists/user-elsie_horne-diabetes_snomed.csv",
     column="code"
-)   
+),
 
 # Depression
-depression_snomed = codelist_from_csv(
+depression_snomed = codelist_spec(
     "codelists/user-hjforbes-depression-symptoms-and-diagnoses.csv",
     column="code"
-)
+),
 
-depression_icd10 = codelist_from_csv(
+depression_icd10 = codelist_spec(
     "codelists/user-kurttaylor-depression_icd10.csv",
     column="code",
-)
+),
 
 # AMI (Acute Myocardial Infarction)
-ami_snomed = codelist_from_csv(
+ami_snomed = codelist_spec(
     "codelists/user-elsie_horne-ami_snomed.csv",
     column="code"
-)
+),
 
-ami_icd10 = codelist_from_csv(
+ami_icd10 = codelist_spec(
     "codelists/user-RochelleKnight-ami_icd10.csv",
     column="code"
-)
+),
 
-ami_prior_icd10 = codelist_from_csv(
+ami_prior_icd10 = codelist_spec(
     "codelists/user-elsie_horne-ami_prior_icd10.csv",
     column="code"
-)
+),
 
 #Quality assurance codes 
 
-prostate_cancer_snomed = codelist_from_csv(
+prostate_cancer_snomed = codelist_spec(
     "codelists/user-RochelleKnight-prostate_cancer_snomed.csv",
     column="code"
-)
-prostate_cancer_icd10 = codelist_from_csv(
+),
+prostate_cancer_icd10 = codelist_spec(
     "codelists/user-RochelleKnight-prostate_cancer_icd10.csv",
     column="code"
-)
-pregnancy_snomed = codelist_from_csv(
+),
+pregnancy_snomed = codelist_spec(
     "codelists/user-RochelleKnight-pregnancy_and_birth_snomed.csv",
     column="code"
-)
-cocp_dmd = codelist_from_csv(
+),
+cocp_dmd = codelist_spec(
     "codelists/user-elsie_horne-cocp_dmd.csv",
     column="dmd_id"
-)
-hrt_dmd = codelist_from_csv(
+),
+hrt_dmd = codelist_spec(
     "codelists/user-elsie_horne-hrt_dmd.csv",
     column="dmd_id"
-)
+),
 
 # Preexisting respiratory condition
 
-copd_ctv3 = codelist_from_csv(
+copd_ctv3 = codelist_spec(
     "codelists/opensafely-current-copd.csv",
     column="CTV3ID"
-)
+),
 
-copd_icd10 = codelist_from_csv(
+copd_icd10 = codelist_spec(
     "codelists/bristol-copd.csv",
     column="code"
-)
+),
 
-asthma_snomed = codelist_from_csv(
+asthma_snomed = codelist_spec(
     "codelists/opensafely-asthma-diagnosis-snomed.csv",
     column="id"
-)
+),
 
-asthma_icd10 = codelist_from_csv(
+asthma_icd10 = codelist_spec(
     "codelists/bristol-asthma.csv",
     column="code"
-)
+),
 
 # Respiratory outcome(s)
 
-pneumonia_snomed = codelist_from_csv(
+pneumonia_snomed = codelist_spec(
     "codelists/bristol-pneumonia-snomed.csv",
     column="code"
-)
+),
 
-pneumonia_icd10 = codelist_from_csv(
+pneumonia_icd10 = codelist_spec(
     "codelists/opensafely-pneumonia-secondary-care.csv",
     column="code"
-)
+),
 
-ild_snomed = codelist_from_csv(
+ild_snomed = codelist_spec(
     "codelists/bristol-ild-snomed.csv",
     column="code"
-)
+),
 
-ild_icd10 = codelist_from_csv(
+ild_icd10 = codelist_spec(
     "codelists/bristol-interstitial-lung-disease-icd10.csv",
     column="code"
+),
+
+# asthma and copd snomed codes are above under 'Preexisting respiratory condition' - same codes and variable names to be used for outcomes
+
 )
 
-# asthma and copd snomed codes are above under 'Preexisting respiratory condition' - same codes and variable names to be used for outcomes
\ No newline at end of file
+__all__ = list(codelist_specs)
+
+_codelists = {}  # loaded codelists
+codelist_load_times = {}  # seconds spent loading each codelist, in load order
+
+def __getattr__(name):
+    if name not in codelist_specs:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if name not in _codelists:
+        start = time.perf_counter()
+        _codelists[name] = load_codelist(**codelist_specs[name])
+        codelist_load_times[name] = time.perf_counter() - start
+    return _codelists[name]
+
+def __dir__():
+    return sorted(set(globals()) | set(codelist_specs))
+
+# Report the codelists loaded so far, with their file, size and load time
+
+def codelist_report():
+    return [
+        dict(
+            name=name,
+            filename=codelist_specs[name]["filename"],
+            codes=len(_codelists[name]),
+            load_seconds=round(seconds, 6),
+        )
+        for name, seconds in codelist_load_times.items()
+    ]
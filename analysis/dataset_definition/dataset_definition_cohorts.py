@@ -9,17 +9,132 @@ from ehrql.tables.tpp import (
 
 from ehrql.query_language import table_from_file, PatientFrame, Series
 
+import os
 from datetime import date
 
+from profiling import assign_variables
+from sharding import in_shard
+
 claim_permissions("appointments")
 
+# index_dates is written by dataset_definition_dates.py as a typed Arrow file: dates are stored as
+# 32-bit day numbers and vax_cat_jcvi_group as a dictionary-encoded category. ehrQL only reads the
+# columns declared in a table_from_file class, so each definition declares just the columns it uses
+# with index_dates_frame, which takes their types from the file's schema.
+
+index_dates_path = "output/dataset_definition/index_dates.arrow"
+
+jcvi_groups = ["01", "02", "03", "04", "05", "06", "07", "08", "09", "10", "11", "12", "99"]
+
+# Series type and options of an Arrow column
+def arrow_series_type(field, reader):
+    import pyarrow as pa
+
+    if pa.types.is_date(field.type):
+        return date, {}
+    if pa.types.is_integer(field.type):
+        return int, {}
+    if pa.types.is_floating(field.type):
+        return float, {}
+    if pa.types.is_boolean(field.type):
+        return bool, {}
+    if pa.types.is_dictionary(field.type):
+        # the categories are the dictionary ehrQL wrote, from the categories of the dates stage's series;
+        # an empty extract has no dictionary, so its categories are those declared for the column
+        if reader.num_record_batches == 0:
+            return named_series_type(field.name)
+        dictionary = reader.get_batch(0).column(field.name).dictionary
+        return str, dict(categories=tuple(dictionary.to_pylist()))
+    return str, {}
+
+# Series type and options of a column, by name, when index_dates has not been extracted yet
+# (e.g. when a definition is only loaded to inspect its variables)
+def named_series_type(name):
+    if name not in index_dates_column_types:
+        raise ValueError(f"Unknown index_dates column {name}: add its type to index_dates_column_types")
+    return index_dates_column_types[name]
+
+def index_dates_types(columns, path=index_dates_path):
+    if not os.path.exists(path):
+        return {name: named_series_type(name) for name in columns}
+    import pyarrow as pa
+
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        missing = [name for name in columns if reader.schema.get_field_index(name) < 0]
+        if missing:
+            raise ValueError(f"{path} has no columns {', '.join(missing)}: run generate_dates again")
+        return {name: arrow_series_type(reader.schema.field(name), reader) for name in columns}
+
+# A PatientFrame over the given columns of index_dates
+def index_dates_frame(*columns, path=index_dates_path):
+    attributes = {
+        name: Series(series_type, **options)
+        for name, (series_type, options) in index_dates_types(columns, path).items()
+    }
+    return table_from_file(path)(type("index_dates", (PatientFrame,), attributes))
+
+# Date variables from index_dates for later pipelines
+
+index_dates_variables = [
+    # Vaccine category and eligibility variables
+    "vax_cat_jcvi_group",
+    "vax_date_eligible",
+    # General COVID vaccination dates
+    "vax_date_covid_1",
+    "vax_date_covid_2",
+    "vax_date_covid_3",
+    # Pfizer vaccine-specific dates
+    "vax_date_Pfizer_1",
+    "vax_date_Pfizer_2",
+    "vax_date_Pfizer_3",
+    # AstraZeneca vaccine-specific dates
+    "vax_date_AstraZeneca_1",
+    "vax_date_AstraZeneca_2",
+    "vax_date_AstraZeneca_3",
+    # Moderna vaccine-specific dates
+    "vax_date_Moderna_1",
+    "vax_date_Moderna_2",
+    "vax_date_Moderna_3",
+    # Censoring date due to death
+    "cens_date_death",
+]
+
+# Types of the index_dates columns read by the dataset definitions, for named_series_type
+
+index_dates_column_types = dict(
+    {name: (date, {}) for name in index_dates_variables},
+    vax_cat_jcvi_group=(str, dict(categories=tuple(jcvi_groups))),
+    death_date_any=(date, {}),
+)
+for cohort in ["prevax", "vax", "unvax"]:
+    index_dates_column_types.update({
+        f"index_{cohort}": (date, {}),
+        f"end_{cohort}_exposure": (date, {}),
+        f"end_{cohort}_outcome": (date, {}),
+        f"cens_date_dereg_{cohort}": (date, {}),
+        f"imd_rounded_{cohort}": (int, {}),
+    })
+
+# Add date variables from index_dates to a dataset
+
+def add_index_dates_variables(dataset):
+    index_dates = index_dates_frame(*index_dates_variables)
+    for name in index_dates_variables:
+        setattr(dataset, name, getattr(index_dates, name))
+
 # Create dataset
 
-def generate_dataset(index_date, end_date_exp, end_date_out):
+# If variables is given (an incremental extraction, see incremental.py), only those variables
+# are extracted. Intermediates computed by the dates stage (cens_date_dereg, death_date, imd) are
+# passed on to generate_variables. Static variables are in input_patients (generate_dataset_patients).
+
+def generate_dataset(index_date, end_date_exp, end_date_out, variables=None, **intermediates):
     dataset = create_dataset()
-    
+
+    # restricted to one shard of patients when run by sharding.py
     dataset.define_population(
-        patients.date_of_birth.is_not_null()
+        in_shard(patients.date_of_birth.is_not_null())
     )
 
 # Configure dummy data
@@ -30,60 +145,86 @@ def generate_dataset(index_date, end_date_exp, end_date_out):
 
     from variables_cohorts import generate_variables
 
-    variables = generate_variables(index_date, end_date_exp, end_date_out)
+    dynamic_variables = generate_variables(index_date, end_date_exp, end_date_out, **intermediates)
+
+    if variables is not None:
+        dynamic_variables = {name: dynamic_variables[name] for name in variables}
 
     # Assign each variable to the dataset
 
-    for var_name, var_value in variables.items():
-        setattr(dataset, var_name, var_value)
+    assign_variables(dataset, dynamic_variables, "cohort")
 
-# Extract date variables for later pipelines
+    return dataset
 
-    @table_from_file("output/dataset_definition/index_dates.csv.gz")
-    
-    class index_dates(PatientFrame):
-    # Vaccine category and eligibility variables
-        vax_cat_jcvi_group = Series(str)
-        vax_date_eligible = Series(date)
+# Create the dataset of static variables shared by all cohorts (input_patients)
 
-    # General COVID vaccination dates
-        vax_date_covid_1 = Series(date)
-        vax_date_covid_2 = Series(date)
-        vax_date_covid_3 = Series(date)
+# The variables that do not depend on a cohort's index dates (generate_static_variables) and the
+# vaccination and JCVI variables of index_dates are the same in every cohort, so they are written
+# once here rather than to each input_<cohort>; later pipelines join them on by patient_id.
 
-    # Pfizer vaccine-specific dates
-        vax_date_Pfizer_1 = Series(date)
-        vax_date_Pfizer_2 = Series(date)
-        vax_date_Pfizer_3 = Series(date)
+def generate_dataset_patients():
+    dataset = create_dataset()
 
-    # AstraZeneca vaccine-specific dates
-        vax_date_AstraZeneca_1 = Series(date)
-        vax_date_AstraZeneca_2 = Series(date)
-        vax_date_AstraZeneca_3 = Series(date)
+    # restricted to one shard of patients when run by sharding.py
+    dataset.define_population(
+        in_shard(patients.date_of_birth.is_not_null())
+    )
 
-    # Moderna vaccine-specific dates
-        vax_date_Moderna_1 = Series(date)
-        vax_date_Moderna_2 = Series(date)
-        vax_date_Moderna_3 = Series(date)
+# Configure dummy data
 
-    # Censoring date due to death
-        cens_date_death = Series(date)
-
-    # Mapping all variables from index_dates to the dataset
-    dataset.vax_cat_jcvi_group = index_dates.vax_cat_jcvi_group
-    dataset.vax_date_eligible = index_dates.vax_date_eligible
-    dataset.vax_date_covid_1 = index_dates.vax_date_covid_1
-    dataset.vax_date_covid_2 = index_dates.vax_date_covid_2
-    dataset.vax_date_covid_3 = index_dates.vax_date_covid_3
-    dataset.vax_date_Pfizer_1 = index_dates.vax_date_Pfizer_1
-    dataset.vax_date_Pfizer_2 = index_dates.vax_date_Pfizer_2
-    dataset.vax_date_Pfizer_3 = index_dates.vax_date_Pfizer_3
-    dataset.vax_date_AstraZeneca_1 = index_dates.vax_date_AstraZeneca_1
-    dataset.vax_date_AstraZeneca_2 = index_dates.vax_date_AstraZeneca_2
-    dataset.vax_date_AstraZeneca_3 = index_dates.vax_date_AstraZeneca_3
-    dataset.vax_date_Moderna_1 = index_dates.vax_date_Moderna_1
-    dataset.vax_date_Moderna_2 = index_dates.vax_date_Moderna_2
-    dataset.vax_date_Moderna_3 = index_dates.vax_date_Moderna_3
-    dataset.cens_date_death = index_dates.cens_date_death
+    dataset.configure_dummy_data(population_size=5000)
+
+# Import variables function
+
+    from variables_cohorts import generate_static_variables
+
+    assign_variables(dataset, generate_static_variables(), "patients")
+
+# Add date variables for later pipelines
+
+    add_index_dates_variables(dataset)
+
+    return dataset
+
+# Create one dataset holding several cohorts (multi-cohort mode)
+
+# cohorts is a dictionary of cohort name -> (index_date, end_date_exp, end_date_out, intermediates),
+# where intermediates is a dictionary of dates-stage intermediates passed to generate_variables.
+# Cohort-specific variables are written as <cohort>__<variable> so that the
+# output can be split back into input_<cohort> files by split_cohorts.py.
+# Static variables are in input_patients (see generate_dataset_patients).
+# All cohorts share the same population, and shared query nodes (e.g. codelist
+# filters on the event tables) are only evaluated once per extraction.
+
+COHORT_SEPARATOR = "__"
+
+def generate_dataset_multi(cohorts):
+    dataset = create_dataset()
+
+    # restricted to one shard of patients when run by sharding.py
+    dataset.define_population(
+        in_shard(patients.date_of_birth.is_not_null())
+    )
+
+# Configure dummy data
+
+    dataset.configure_dummy_data(population_size=5000)
+
+# Import variables function
+
+    from variables_cohorts import generate_variables
+
+    # Assign each cohort's variables to the dataset
+
+    for cohort, (index_date, end_date_exp, end_date_out, intermediates) in cohorts.items():
+        variables = generate_variables(index_date, end_date_exp, end_date_out, **intermediates)
+        assign_variables(dataset, variables, cohort, prefix=f"{cohort}{COHORT_SEPARATOR}")
+
+# Add cohort dates (kept last, as in the single cohort definitions)
+
+    for cohort, (index_date, end_date_exp, end_date_out, _) in cohorts.items():
+        setattr(dataset, f"{cohort}{COHORT_SEPARATOR}index_date", index_date)
+        setattr(dataset, f"{cohort}{COHORT_SEPARATOR}end_date_exposure", end_date_exp)
+        setattr(dataset, f"{cohort}{COHORT_SEPARATOR}end_date_outcome", end_date_out)
 
     return dataset
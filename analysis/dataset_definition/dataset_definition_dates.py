@@ -9,11 +9,16 @@ from ehrql import (
 
 from ehrql.tables.tpp import ( 
     patients, 
-    practice_registrations,
+    ons_deaths,
+    addresses,
 )
 
 from datetime import date
 
+from profiling import assign_variables
+
+from variable_helper_functions import first_deregistration_dates
+
 # create dataset to create dates for different cohorts
 
 dataset = create_dataset()
@@ -42,30 +47,44 @@ from variables_dates import prelim_date_variables
 
   ## Add the imported variables to the dataset
 
-for var_name, var_value in prelim_date_variables.items():
-    setattr(dataset, var_name, var_value)
+assign_variables(dataset, prelim_date_variables, "prelim")
 
 # Import jcvi variables ( JCVI group and derived variables; eligible date for vaccination based on JCVI group)
 from variables_dates import jcvi_variables
 
   ## Add the imported variables to the dataset
-for var_name, var_value in jcvi_variables.items():
-    setattr(dataset, var_name, var_value)
+assign_variables(dataset, jcvi_variables, "jcvi")
 
 # Generate cohort dates
 
-## Prevax
+## Index dates
+
+index_prevax = minimum_of(date.fromisoformat(pandemic_start), date.fromisoformat(pandemic_start))
 
-dataset.index_prevax = minimum_of(date.fromisoformat(pandemic_start), date.fromisoformat(pandemic_start))
+index_vax = maximum_of(
+    dataset.vax_date_covid_2 + days(14),
+    date.fromisoformat(delta_date)
+)
 
-cens_date_dereg_prevax = (
-    practice_registrations.where(practice_registrations.end_date.is_not_null())
-    .where(practice_registrations.end_date.is_on_or_after(dataset.index_prevax))
-    .sort_by(practice_registrations.end_date)
-    .first_for_patient()
-    .end_date
+index_unvax = maximum_of(
+    dataset.vax_date_eligible + days(84),
+    date.fromisoformat(delta_date)
 )
 
+## Deregistration dates for all cohorts, from one set of practice registrations
+
+cens_date_dereg = first_deregistration_dates(dict(
+    prevax = index_prevax,
+    vax = index_vax,
+    unvax = index_unvax,
+))
+
+## Prevax
+
+dataset.index_prevax = index_prevax
+
+cens_date_dereg_prevax = cens_date_dereg["prevax"]
+
 dataset.end_prevax_exposure = minimum_of(
     dataset.cens_date_death, 
     cens_date_dereg_prevax,
@@ -83,18 +102,9 @@ dataset.end_prevax_outcome = minimum_of(
 
 ## Vax
 
-dataset.index_vax = maximum_of(
-    dataset.vax_date_covid_2 + days(14),
-    date.fromisoformat(delta_date)
-)
+dataset.index_vax = index_vax
 
-cens_date_dereg_vax = (
-    practice_registrations.where(practice_registrations.end_date.is_not_null())
-    .where(practice_registrations.end_date.is_on_or_after(dataset.index_vax))
-    .sort_by(practice_registrations.end_date)
-    .first_for_patient()
-    .end_date
-)
+cens_date_dereg_vax = cens_date_dereg["vax"]
 
 dataset.end_vax_exposure = minimum_of(
     dataset.cens_date_death, 
@@ -111,18 +121,9 @@ dataset.end_vax_outcome = minimum_of(
 
 ## Unvax
 
-dataset.index_unvax = maximum_of(
-    dataset.vax_date_eligible + days(84),
-    date.fromisoformat(delta_date)
-)
+dataset.index_unvax = index_unvax
 
-cens_date_dereg_unvax = (
-    practice_registrations.where(practice_registrations.end_date.is_not_null())
-    .where(practice_registrations.end_date.is_on_or_after(dataset.index_unvax))
-    .sort_by(practice_registrations.end_date)
-    .first_for_patient()
-    .end_date
-)
+cens_date_dereg_unvax = cens_date_dereg["unvax"]
 
 dataset.end_unvax_exposure = minimum_of(
     dataset.cens_date_death, 
@@ -136,4 +137,19 @@ dataset.end_unvax_outcome = minimum_of(
     dataset.cens_date_death, 
     cens_date_dereg_unvax,
     lcd_date
-)
\ No newline at end of file
+)
+
+# Intermediates reused by the cohort definitions instead of querying the tables again
+
+  ## Deregistration date on or after each cohort's index date
+dataset.cens_date_dereg_prevax = cens_date_dereg_prevax
+dataset.cens_date_dereg_vax = cens_date_dereg_vax
+dataset.cens_date_dereg_unvax = cens_date_dereg_unvax
+
+  ## Earliest death date from primary care or ONS (unlike cens_date_death, not restricted to the pandemic)
+dataset.death_date_any = minimum_of(patients.date_of_death, ons_deaths.date)
+
+  ## IMD at each cohort's index date, used by imd_cut_points.py for the IMD deciles
+dataset.imd_rounded_prevax = addresses.for_patient_on(index_prevax).imd_rounded
+dataset.imd_rounded_vax = addresses.for_patient_on(index_vax).imd_rounded
+dataset.imd_rounded_unvax = addresses.for_patient_on(index_unvax).imd_rounded
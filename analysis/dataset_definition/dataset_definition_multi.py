@@ -0,0 +1,65 @@
+from dataset_definition_cohorts import generate_dataset_multi, index_dates_frame
+from imd_cut_points import read_imd_cut_points
+
+# extract index dates for all cohorts from index_dates.arrow
+
+index_dates = index_dates_frame(
+    "index_prevax",
+    "end_prevax_exposure",
+    "end_prevax_outcome",
+    "index_vax",
+    "end_vax_exposure",
+    "end_vax_outcome",
+    "index_unvax",
+    "end_unvax_exposure",
+    "end_unvax_outcome",
+    "cens_date_dereg_prevax",
+    "cens_date_dereg_vax",
+    "cens_date_dereg_unvax",
+    "death_date_any",
+    "imd_rounded_prevax",
+    "imd_rounded_vax",
+    "imd_rounded_unvax",
+)
+
+# Define (index_date, end_date_exposure, end_date_outcome, intermediates) for each cohort
+
+cohorts = dict(
+    prevax = (
+        index_dates.index_prevax,
+        index_dates.end_prevax_exposure,
+        index_dates.end_prevax_outcome,
+        dict(
+            cens_date_dereg = index_dates.cens_date_dereg_prevax,
+            death_date = index_dates.death_date_any,
+            imd = index_dates.imd_rounded_prevax,
+            imd_cut_points = read_imd_cut_points("prevax", groups=10),
+        )
+    ),
+    vax = (
+        index_dates.index_vax,
+        index_dates.end_vax_exposure,
+        index_dates.end_vax_outcome,
+        dict(
+            cens_date_dereg = index_dates.cens_date_dereg_vax,
+            death_date = index_dates.death_date_any,
+            imd = index_dates.imd_rounded_vax,
+            imd_cut_points = read_imd_cut_points("vax", groups=10),
+        )
+    ),
+    unvax = (
+        index_dates.index_unvax,
+        index_dates.end_unvax_exposure,
+        index_dates.end_unvax_outcome,
+        dict(
+            cens_date_dereg = index_dates.cens_date_dereg_unvax,
+            death_date = index_dates.death_date_any,
+            imd = index_dates.imd_rounded_unvax,
+            imd_cut_points = read_imd_cut_points("unvax", groups=10),
+        )
+    ),
+)
+
+# Create dataset holding all cohorts (split into input_<cohort> by split_cohorts.py)
+
+dataset = generate_dataset_multi(cohorts)
@@ -0,0 +1,6 @@
+from dataset_definition_cohorts import generate_dataset_patients
+
+# Create dataset of the static variables shared by all cohorts, joined onto each input_<cohort>
+# by patient_id in dataset_clean
+
+dataset = generate_dataset_patients()
@@ -1,26 +1,39 @@
-from dataset_definition_cohorts import generate_dataset
+from dataset_definition_cohorts import generate_dataset, index_dates_frame
+from incremental import incremental_variables
+from imd_cut_points import read_imd_cut_points
 
-from ehrql.query_language import table_from_file, PatientFrame, Series
+# extract index dates for unvax cohort from index_dates.arrow
 
-from datetime import date
-
-# extract index dates for unvax cohort from index_dates.csv
-
-@table_from_file("output/dataset_definition/index_dates.csv.gz")
-
-class index_dates(PatientFrame):
-    index_unvax = Series(date)
-    end_unvax_exposure = Series(date)
-    end_unvax_outcome = Series(date)
+index_dates = index_dates_frame(
+    "index_unvax",
+    "end_unvax_exposure",
+    "end_unvax_outcome",
+    "cens_date_dereg_unvax",
+    "death_date_any",
+    "imd_rounded_unvax",
+)
 
 index_date = index_dates.index_unvax
 end_date_exposure = index_dates.end_unvax_exposure
 end_date_outcome = index_dates.end_unvax_outcome
 
-# Create dataset
+# Intermediates computed by the dates stage, so that they are not queried again,
+# and the IMD cut points computed from it (see imd_cut_points.py)
+
+intermediates = dict(
+    cens_date_dereg = index_dates.cens_date_dereg_unvax,
+    death_date = index_dates.death_date_any,
+    imd = index_dates.imd_rounded_unvax,
+    imd_cut_points = read_imd_cut_points("unvax", groups=10),
+)
+
+# Create dataset (only the changed variables when run with `-- --incremental`)
+
+variables = incremental_variables("unvax")
 
-dataset = generate_dataset(index_date, end_date_exposure, end_date_outcome)
+dataset = generate_dataset(index_date, end_date_exposure, end_date_outcome, variables, **intermediates)
 
-dataset.index_date = index_date
-dataset.end_date_exposure = end_date_exposure
-dataset.end_date_outcome = end_date_outcome
\ No newline at end of file
+if variables is None:
+    dataset.index_date = index_date
+    dataset.end_date_exposure = end_date_exposure
+    dataset.end_date_outcome = end_date_outcome
\ No newline at end of file
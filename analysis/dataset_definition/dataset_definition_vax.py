@@ -1,26 +1,39 @@
-from dataset_definition_cohorts import generate_dataset
+from dataset_definition_cohorts import generate_dataset, index_dates_frame
+from incremental import incremental_variables
+from imd_cut_points import read_imd_cut_points
 
-from ehrql.query_language import table_from_file, PatientFrame, Series
+# extract index dates for vax cohort from index_dates.arrow
 
-from datetime import date
-
-# extract index dates for vax cohort from index_dates.csv
-
-@table_from_file("output/dataset_definition/index_dates.csv.gz")
-
-class index_dates(PatientFrame):
-    index_vax = Series(date)
-    end_vax_exposure = Series(date)
-    end_vax_outcome = Series(date)
+index_dates = index_dates_frame(
+    "index_vax",
+    "end_vax_exposure",
+    "end_vax_outcome",
+    "cens_date_dereg_vax",
+    "death_date_any",
+    "imd_rounded_vax",
+)
 
 index_date = index_dates.index_vax
 end_date_exposure = index_dates.end_vax_exposure
 end_date_outcome = index_dates.end_vax_outcome
 
-# Create dataset
+# Intermediates computed by the dates stage, so that they are not queried again,
+# and the IMD cut points computed from it (see imd_cut_points.py)
+
+intermediates = dict(
+    cens_date_dereg = index_dates.cens_date_dereg_vax,
+    death_date = index_dates.death_date_any,
+    imd = index_dates.imd_rounded_vax,
+    imd_cut_points = read_imd_cut_points("vax", groups=10),
+)
+
+# Create dataset (only the changed variables when run with `-- --incremental`)
+
+variables = incremental_variables("vax")
 
-dataset = generate_dataset(index_date, end_date_exposure, end_date_outcome)
+dataset = generate_dataset(index_date, end_date_exposure, end_date_outcome, variables, **intermediates)
 
-dataset.index_date = index_date
-dataset.end_date_exposure = end_date_exposure
-dataset.end_date_outcome = end_date_outcome
\ No newline at end of file
+if variables is None:
+    dataset.index_date = index_date
+    dataset.end_date_exposure = end_date_exposure
+    dataset.end_date_outcome = end_date_outcome
\ No newline at end of file
@@ -0,0 +1,143 @@
+# IMD cut points from the distribution of IMD in the extracted population
+#
+# Usage: python analysis/dataset_definition/imd_cut_points.py [--groups 10] [--k 200]
+#
+# The dates stage writes imd_rounded_<cohort> (IMD at each cohort's index date) to index_dates.arrow.
+# This streams each column through a quantile sketch and writes the cut points of the groups
+# (e.g. deciles) to output/dataset_definition/imd_cut_points.json, which the cohort dataset
+# definitions pass to get_imd (see variable_helper_functions.py). The file records the cut points
+# used, so the grouping can be reproduced; when it is missing, get_imd uses equal steps up to max_imd.
+#
+# The sketch (a KLL sketch) holds at most about 3k values whatever the size of the population (plus
+# the record batch being added), with a rank error of about 1.7 / k (under 1% for the default
+# k = 200). Batches are added and compacted as numpy arrays. Compactions alternate
+# deterministically, so the same input gives the same cut points.
+
+import argparse
+import json
+import os
+
+index_dates_path = "output/dataset_definition/index_dates.arrow"
+imd_cut_points_path = "output/dataset_definition/imd_cut_points.json"
+
+cohorts = ["prevax", "vax", "unvax"]
+
+class QuantileSketch:
+    def __init__(self, k=200):
+        import numpy as np
+
+        self.k = k
+        self.levels = [np.empty(0, dtype=np.int64)]
+        self.compactions = [0]
+        self.count = 0
+
+    # Capacity of a level: the top level holds k values, each level below two thirds of the one above
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(self.k * (2 / 3) ** depth))
+
+    def update(self, value):
+        if value is not None:
+            self.update_many([value])
+
+    # Add a batch of values (e.g. a record batch column without its nulls) at once; NaNs are skipped
+    def update_many(self, values):
+        import numpy as np
+
+        values = np.asarray(values)
+        if values.dtype.kind == "f":
+            values = values[~np.isnan(values)]
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.count += len(values)
+        self.compact()
+
+    # Halve the lowest level over capacity until every level fits: every other value moves up a
+    # level, with twice the weight. A level can hold a whole batch, so it may be halved several times
+    def compact(self):
+        import numpy as np
+
+        level = 0
+        while level < len(self.levels):
+            values = self.levels[level]
+            if len(values) <= self.capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0, dtype=np.int64))
+                self.compactions.append(0)
+            values = np.sort(values)
+            kept = values[len(values) - len(values) % 2:]
+            paired = values[:len(values) - len(kept)]
+            promoted = paired[self.compactions[level] % 2::2]
+            self.compactions[level] += 1
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            self.levels[level] = kept
+            level = 0
+
+    def weighted_values(self):
+        import numpy as np
+
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(values), 2 ** level) for level, values in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        return values[order], weights[order]
+
+    # Smallest value with at least a fraction q of the population at or below it
+    def quantile(self, q):
+        return self.quantiles([q])[0]
+
+    def quantiles(self, qs):
+        import numpy as np
+
+        values, weights = self.weighted_values()
+        if len(values) == 0:
+            return [None for q in qs]
+        ranks = np.cumsum(weights)
+        i = np.minimum(np.searchsorted(ranks, np.asarray(qs) * ranks[-1], "left"), len(values) - 1)
+        return [value.item() for value in values[i]]
+
+    # Boundaries between groups of equal size: group i is (cut_points[i - 1], cut_points[i]], so
+    # values equal to a cut point fall in the lower group, as quantile() counts them at or below it
+    def cut_points(self, groups):
+        return self.quantiles([i / groups for i in range(1, groups)])
+
+def read_imd_cut_points(cohort, groups, path=imd_cut_points_path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        cut_points = json.load(f)
+    if cut_points["groups"] != groups:
+        raise ValueError(f"{path} has cut points for {cut_points['groups']} groups, not {groups}")
+    return cut_points["cut_points"][cohort]
+
+# Stream the IMD columns of index_dates.arrow through a sketch per cohort, one record batch at a time
+
+def sketch_index_dates(path, cohorts, k):
+    import pyarrow as pa
+
+    sketches = {cohort: QuantileSketch(k) for cohort in cohorts}
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for cohort, sketch in sketches.items():
+                sketch.update_many(batch.column(f"imd_rounded_{cohort}").drop_null().to_numpy())
+    return sketches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute IMD cut points from index_dates.arrow")
+    parser.add_argument("--groups", type=int, default=10)
+    parser.add_argument("--k", type=int, default=200)
+    parser.add_argument("--input", default=index_dates_path)
+    parser.add_argument("--output", default=imd_cut_points_path)
+    args = parser.parse_args()
+
+    sketches = sketch_index_dates(args.input, cohorts, args.k)
+    cut_points = dict(
+        groups=args.groups,
+        k=args.k,
+        cut_points={cohort: sketch.cut_points(args.groups) for cohort, sketch in sketches.items()},
+        patients={cohort: sketch.count for cohort, sketch in sketches.items()},
+    )
+    with open(args.output, "w") as f:
+        json.dump(cut_points, f, indent=2)
@@ -0,0 +1,191 @@
+# Incremental re-extraction of a cohort, keyed by per-variable hashes
+#
+# Each variable returned by variables_cohorts.generate_variables is hashed from its ehrQL
+# query graph. The graph includes every codelist the variable uses (as the set of codes),
+# so a change to a definition or to the contents of one of its codelists changes the hash.
+#
+# Usage (from the repository root, with ehrQL installed; not used by project.yaml):
+#   1. After a full extraction of input_<cohort>.csv.gz, record its hashes:
+#        python analysis/dataset_definition/incremental.py record <cohort>
+#   2. After editing variables or codelists, list the variables whose hash changed:
+#        python analysis/dataset_definition/incremental.py plan <cohort>
+#   3. Extract only those variables:
+#        ehrql generate-dataset analysis/dataset_definition/dataset_definition_<cohort>.py
+#          --output output/dataset_definition/input_<cohort>_delta.csv.gz -- --incremental
+#   4. Splice them into the previous output by patient_id and record the new hashes:
+#        python analysis/dataset_definition/incremental.py splice <cohort>
+#
+# A full extraction is needed instead if index_dates or the population has changed.
+
+import csv
+import dataclasses
+import datetime
+import enum
+import gzip
+import hashlib
+import json
+import os
+import runpy
+import sys
+
+output_dir = "output/dataset_definition"
+
+def input_path(cohort):
+    return f"{output_dir}/input_{cohort}.csv.gz"
+
+def delta_path(cohort):
+    return f"{output_dir}/input_{cohort}_delta.csv.gz"
+
+def hashes_path(cohort):
+    return f"{output_dir}/input_{cohort}_hashes.json"
+
+def plan_path(cohort):
+    return f"{output_dir}/input_{cohort}_changed.json"
+
+# Hashing ---------------------------------------------------------------------------------------
+
+# Convert a query graph into nested lists that serialise to the same JSON in every process
+# (sets are sorted, as their iteration order depends on string hashing). Values of any other type
+# raise TypeError rather than falling back to repr(), which can include memory addresses
+def canonical(obj):
+    from ehrql.query_model.nodes import TableSchema
+
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return [type(obj).__name__, obj.isoformat()]
+    if isinstance(obj, enum.Enum):
+        return [type(obj).__qualname__, obj.name]
+    if isinstance(obj, os.PathLike):
+        return os.fspath(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return [type(obj).__name__] + [
+            [field.name, canonical(getattr(obj, field.name))]
+            for field in dataclasses.fields(obj)
+        ]
+    if isinstance(obj, TableSchema):
+        return ["TableSchema", canonical(obj.schema)]
+    # ehrQL's file-backed rows (e.g. of table_from_file) compare by class, file and columns
+    if hasattr(obj, "_comparison_key"):
+        return [type(obj).__name__, canonical(obj._comparison_key())]
+    if isinstance(obj, (set, frozenset)):
+        return sorted((canonical(item) for item in obj), key=json.dumps)
+    if isinstance(obj, (list, tuple)):
+        return [canonical(item) for item in obj]
+    if isinstance(obj, dict):
+        return sorted(([canonical(k), canonical(v)] for k, v in obj.items()), key=json.dumps)
+    if isinstance(obj, type):
+        return obj.__qualname__
+    raise TypeError(f"Cannot hash a {type(obj).__qualname__} in a query graph: {obj!r}")
+
+def variable_hash(series):
+    # ehrQL series wrap a query model node, which holds the whole query graph of the variable
+    node = series._qm_node
+    return hashlib.sha256(json.dumps(canonical(node)).encode()).hexdigest()
+
+# Hash every variable of a cohort, using the index dates declared in its dataset definition
+def cohort_hashes(cohort):
+    definition = runpy.run_path(f"analysis/dataset_definition/dataset_definition_{cohort}.py")
+    from variables_cohorts import generate_variables
+    variables = generate_variables(
+        definition["index_date"], definition["end_date_exposure"], definition["end_date_outcome"],
+        **definition["intermediates"],
+    )
+    return {name: variable_hash(series) for name, series in variables.items()}
+
+def read_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+def write_json(path, obj):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(obj, f, indent=2)
+
+# Variables whose hash differs from the recorded hashes (all variables if none were recorded)
+def changed_variables(hashes, recorded):
+    return [name for name, value in hashes.items() if recorded.get(name) != value]
+
+# Variables to extract in an incremental run -----------------------------------------------------
+
+# Called from the cohort dataset definitions: returns None for a full extraction, or the list of
+# variables to extract when the definition is run with `-- --incremental`
+def incremental_variables(cohort):
+    if "--incremental" not in sys.argv[1:]:
+        return None
+    plan = read_json(plan_path(cohort))
+    if plan is None:
+        raise FileNotFoundError(f"Run `incremental.py plan {cohort}` before an incremental extraction")
+    if not plan["changed"]:
+        sys.exit(f"Nothing to re-extract: no variable of {cohort} has changed since the recorded extraction")
+    return plan["changed"]
+
+# Splicing --------------------------------------------------------------------------------------
+
+# Replace (or add) the delta columns in the previous output and drop removed variables;
+# both files come from the same population, so their rows are in the same patient order
+def splice(previous_path, delta_path, output_path, keep):
+    with gzip.open(previous_path, "rt", newline="") as f_prev, \
+            gzip.open(delta_path, "rt", newline="") as f_delta, \
+            gzip.open(output_path, "wt", newline="") as f_out:
+        previous = csv.reader(f_prev)
+        delta = csv.reader(f_delta)
+        writer = csv.writer(f_out, lineterminator="\n")
+
+        previous_header = next(previous)
+        delta_header = next(delta)
+        delta_index = {name: i for i, name in enumerate(delta_header)}
+        header = [name for name in previous_header if name in keep or name in delta_index]
+        header += [name for name in delta_header if name not in previous_header]
+        sources = [
+            (True, delta_index[name]) if name in delta_index else (False, previous_header.index(name))
+            for name in header
+        ]
+        writer.writerow(header)
+
+        for previous_row, delta_row in zip(previous, delta, strict=True):
+            if previous_row[0] != delta_row[0]:
+                raise ValueError(
+                    f"Patient order differs ({previous_row[0]} != {delta_row[0]}): run a full extraction"
+                )
+            writer.writerow([
+                delta_row[i] if from_delta else previous_row[i] for from_delta, i in sources
+            ])
+
+if __name__ == "__main__":
+    sys.path.insert(0, "analysis/dataset_definition")
+    command, cohort = sys.argv[1:3]
+
+    if command == "record":
+        write_json(hashes_path(cohort), cohort_hashes(cohort))
+
+    elif command == "plan":
+        hashes = cohort_hashes(cohort)
+        changed = changed_variables(hashes, read_json(hashes_path(cohort), {}))
+        write_json(plan_path(cohort), dict(changed=changed, hashes=hashes))
+        if changed:
+            print(f"{len(changed)} of {len(hashes)} variables changed: {', '.join(changed)}")
+        else:
+            print(f"Nothing to re-extract: none of the {len(hashes)} variables changed")
+
+    elif command == "splice":
+        plan = read_json(plan_path(cohort))
+        if not plan["changed"]:
+            print(f"Nothing to splice: no variable of {cohort} changed")
+            sys.exit()
+        tmp_path = f"{input_path(cohort)}.tmp"
+        # Keep everything that is not a cohort variable (patient_id, index_dates columns, cohort dates)
+        # and every variable that still exists
+        with gzip.open(input_path(cohort), "rt", newline="") as f:
+            previous_header = next(csv.reader(f))
+        removed = set(read_json(hashes_path(cohort), {})) - set(plan["hashes"])
+        keep = {name for name in previous_header if name not in removed}
+        splice(input_path(cohort), delta_path(cohort), tmp_path, keep)
+        os.replace(tmp_path, input_path(cohort))
+        write_json(hashes_path(cohort), plan["hashes"])
+        print(f"Spliced {len(plan['changed'])} variables into {input_path(cohort)}")
+
+    else:
+        raise ValueError(f"Unknown command: {command}")
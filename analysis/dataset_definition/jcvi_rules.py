@@ -0,0 +1,92 @@
+# Compile the JCVI rule tables into ehrQL variables
+#
+# lib/jcvi_groups.csv lists the JCVI group rules in priority order: a patient is in the group of
+# the first rule they meet. A rule can require a condition (a boolean variable passed to
+# jcvi_group) and an age range [min_age, max_age) on one of the age variables. The rule with
+# neither gives the default group.
+#
+# lib/jcvi_eligibility.csv lists the vaccination eligibility date by JCVI group, optionally for
+# age ranges within a group ([min_age, max_age), each bound on its own age variable). Rules are
+# applied in order within each group; the rule with no group gives the default date.
+#
+# Groups that only need their group to be known are looked up together in one is_in test per date,
+# and the age rules of each group are only evaluated for patients in that group.
+
+import csv
+import operator
+from datetime import date
+from functools import reduce
+
+from ehrql import case, when
+
+jcvi_groups_path = "lib/jcvi_groups.csv"
+jcvi_eligibility_path = "lib/jcvi_eligibility.csv"
+
+def read_rules(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+# Conditions for a rule's age bounds: min_age is inclusive and max_age is exclusive
+def age_conditions(ages, min_variable, min_age, max_variable, max_age):
+    conditions = []
+    if min_age:
+        conditions.append(ages[min_variable] >= int(min_age))
+    if max_age:
+        conditions.append(ages[max_variable] < int(max_age))
+    return conditions
+
+def all_of(conditions):
+    return reduce(operator.and_, conditions)
+
+# ages and conditions are dicts of the variables named in the rules
+def jcvi_group(ages, conditions, rules=None):
+    rules = read_rules(jcvi_groups_path) if rules is None else rules
+    branches = []
+    default = None
+    for rule in rules:
+        rule_conditions = [conditions[rule["condition"]]] if rule["condition"] else []
+        rule_conditions += age_conditions(
+            ages, rule["age_variable"], rule["min_age"], rule["age_variable"], rule["max_age"]
+        )
+        if not rule_conditions:
+            default = rule["group"]
+            break
+        branches.append(when(all_of(rule_conditions)).then(rule["group"]))
+    return case(*branches, otherwise=default)
+
+def jcvi_eligible_date(group, ages, rules=None):
+    rules = read_rules(jcvi_eligibility_path) if rules is None else rules
+    default = None
+    group_rules = {}
+    for rule in rules:
+        if not rule["group"]:
+            default = date.fromisoformat(rule["eligible_date"])
+            break
+        group_rules.setdefault(rule["group"], []).append(rule)
+
+    # Groups with a single date for all ages, gathered by date
+    groups_by_date = {}
+    # Groups with dates by age range, evaluated within the group
+    age_branches = []
+    for group_name, rules_in_group in group_rules.items():
+        first = rules_in_group[0]
+        if len(rules_in_group) == 1 and not (first["min_age"] or first["max_age"]):
+            groups_by_date.setdefault(date.fromisoformat(first["eligible_date"]), []).append(group_name)
+            continue
+        branches = []
+        group_default = default
+        for rule in rules_in_group:
+            rule_conditions = age_conditions(
+                ages, rule["min_age_variable"], rule["min_age"], rule["max_age_variable"], rule["max_age"]
+            )
+            if not rule_conditions:
+                group_default = date.fromisoformat(rule["eligible_date"])
+                break
+            branches.append(when(all_of(rule_conditions)).then(date.fromisoformat(rule["eligible_date"])))
+        age_branches.append(when(group == group_name).then(case(*branches, otherwise=group_default)))
+
+    return case(
+        *[when(group.is_in(group_names)).then(eligible_date) for eligible_date, group_names in groups_by_date.items()],
+        *age_branches,
+        otherwise=default,
+    )
@@ -0,0 +1,53 @@
+# Profiling hook for adding variables to a dataset
+#
+# The dataset definitions add their variables with assign_variables. When profiling is enabled
+# (by analysis/local_pipeline/profile_variables.py), it also records the size of each variable's
+# ehrQL query graph: the source tables it reads, the number of query nodes and the number of
+# codes in the codelists it uses. ehrQL only evaluates the variables after the dataset definition
+# has run, so evaluation times and result sizes are measured separately (see benchmark.py).
+
+enabled = False
+variable_profiles = []  # one entry per variable assigned while profiling is enabled
+
+# Walk the query graph of a variable, counting each node once
+
+def graph_stats(series):
+    tables = set()
+    nodes = 0
+    codes = 0
+    seen = set()
+    stack = [series._qm_node]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        nodes += 1
+        node_type = type(node).__name__
+        if node_type in ("SelectTable", "SelectPatientTable"):
+            tables.add(node.name)
+        elif node_type == "InlinePatientTable":
+            tables.add("table_from_file")
+        elif node_type == "Value" and isinstance(node.value, frozenset):
+            codes += len(node.value)
+        stack.extend(children(node))
+    return dict(tables=sorted(tables), nodes=nodes, codes=codes)
+
+def children(node):
+    fields = getattr(node, "__dataclass_fields__", {})
+    for name in fields:
+        value = getattr(node, name)
+        if isinstance(value, (tuple, list, frozenset, set)):
+            yield from (item for item in value if hasattr(item, "__dataclass_fields__"))
+        elif isinstance(value, dict):
+            yield from (item for item in value.values() if hasattr(item, "__dataclass_fields__"))
+        elif hasattr(value, "__dataclass_fields__"):
+            yield value
+
+# Add each variable to the dataset (recording its query graph when profiling)
+
+def assign_variables(dataset, variables, group, prefix=""):
+    for var_name, var_value in variables.items():
+        setattr(dataset, f"{prefix}{var_name}", var_value)
+        if enabled:
+            variable_profiles.append(dict(group=group, name=var_name, **graph_stats(var_value)))
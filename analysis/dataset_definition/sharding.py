@@ -0,0 +1,196 @@
+# Patient-sharded extraction of a cohort
+#
+# Patients are partitioned into shards by a stable hash of patient_id, each shard is extracted
+# by its own ehrQL process, and the shard outputs are merged back into one file in patient order.
+#
+# Usage (from the repository root, with ehrQL and pyarrow installed; not used by project.yaml):
+#   python analysis/dataset_definition/sharding.py <cohort|multi> [--shards 8] [--workers 8]
+#       [--format csv.gz|arrow] [--incremental] [<ehrql generate-dataset options, e.g. --dummy-tables <dir>>]
+#
+# 1. The patient_ids of index_dates.arrow (the population of every cohort) are written to one
+#    shard file per shard, output/dataset_definition/shards/<shards>/shard_<i>.arrow.
+# 2. dataset_definition_<cohort>.py is extracted for each shard, with `-- --shard <shard file>`
+#    restricting its population to the patients in that shard (see in_shard), by a pool of
+#    `workers` ehrQL processes.
+# 3. The shard outputs, each in patient order, are merged into input_<cohort>.<format> with a
+#    k-way merge that holds one row per shard in memory.
+
+import argparse
+import csv
+import gzip
+import hashlib
+import heapq
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+output_dir = "output/dataset_definition"
+index_dates_path = f"{output_dir}/index_dates.arrow"
+
+def shard_dir(shards):
+    return f"{output_dir}/shards/{shards}"
+
+def shard_path(shards, shard):
+    return f"{shard_dir(shards)}/shard_{shard}.arrow"
+
+def shard_output_path(cohort, shards, shard, extension):
+    return f"{shard_dir(shards)}/input_{cohort}_{shard}.{extension}"
+
+# Shard of a patient: stable across processes and Python versions (unlike hash())
+def shard_of(patient_id, shards):
+    digest = hashlib.blake2b(str(patient_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+# Population restriction ----------------------------------------------------------------------------
+
+# Called from the dataset definitions: returns the population unchanged, or restricted to the
+# patients of the shard file when the definition is run with `-- --shard <shard file>`
+def in_shard(population):
+    args = sys.argv[1:]
+    if "--shard" not in args:
+        return population
+
+    from ehrql.query_language import table_from_file, PatientFrame, Series
+
+    @table_from_file(args[args.index("--shard") + 1])
+    class shard_patients(PatientFrame):
+        shard = Series(int)
+
+    return population & shard_patients.shard.is_not_null()
+
+# Writing the shard files ---------------------------------------------------------------------------
+
+def write_shards(shards, source=index_dates_path):
+    import pyarrow as pa
+
+    os.makedirs(shard_dir(shards), exist_ok=True)
+    schema = pa.schema([("patient_id", pa.int64()), ("shard", pa.int64())])
+    writers = [pa.ipc.new_file(shard_path(shards, shard), schema) for shard in range(shards)]
+    try:
+        with pa.memory_map(source) as f:
+            reader = pa.ipc.open_file(f)
+            for i in range(reader.num_record_batches):
+                patient_ids = reader.get_batch(i).column("patient_id").to_pylist()
+                by_shard = [[] for shard in range(shards)]
+                for patient_id in patient_ids:
+                    by_shard[shard_of(patient_id, shards)].append(patient_id)
+                for shard, shard_patient_ids in enumerate(by_shard):
+                    if shard_patient_ids:
+                        writers[shard].write_batch(pa.record_batch(
+                            [shard_patient_ids, [shard] * len(shard_patient_ids)], schema=schema
+                        ))
+    finally:
+        for writer in writers:
+            writer.close()
+
+# Extracting the shards -----------------------------------------------------------------------------
+
+def definition_path(cohort):
+    return f"analysis/dataset_definition/dataset_definition_{cohort}.py"
+
+def extract_shard(cohort, shards, shard, extension, ehrql_args, definition_args):
+    command = [
+        "ehrql", "generate-dataset", definition_path(cohort),
+        "--output", shard_output_path(cohort, shards, shard, extension),
+        *ehrql_args,
+        "--", "--shard", shard_path(shards, shard), *definition_args,
+    ]
+    subprocess.run(command, check=True)
+
+# Each shard is extracted by its own ehrQL process; the pool only waits on them
+def extract_shards(cohort, shards, workers, extension, ehrql_args, definition_args):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(extract_shard, cohort, shards, shard, extension, ehrql_args, definition_args)
+            for shard in range(shards)
+        ]
+        for future in futures:
+            future.result()
+
+# Merging the shard outputs -------------------------------------------------------------------------
+
+def check_order(rows, path):
+    previous = None
+    for patient_id, row in rows:
+        if previous is not None and patient_id <= previous:
+            raise ValueError(f"{path} is not in patient order ({patient_id} after {previous})")
+        previous = patient_id
+        yield patient_id, row
+
+def csv_rows(path):
+    with gzip.open(path, "rt", newline="") as f:
+        reader = csv.reader(f)
+        next(reader)
+        for row in reader:
+            yield int(row[0]), row
+
+def merge_csv(paths, output_path):
+    headers = []
+    for path in paths:
+        with gzip.open(path, "rt", newline="") as f:
+            headers.append(next(csv.reader(f)))
+    if any(header != headers[0] for header in headers):
+        raise ValueError("Shard outputs have different columns")
+
+    with gzip.open(output_path, "wt", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(headers[0])
+        rows = [check_order(csv_rows(path), path) for path in paths]
+        for patient_id, row in heapq.merge(*rows, key=lambda item: item[0]):
+            writer.writerow(row)
+
+def arrow_rows(path):
+    import pyarrow as pa
+
+    with pa.memory_map(path) as f:
+        reader = pa.ipc.open_file(f)
+        for i in range(reader.num_record_batches):
+            for row in reader.get_batch(i).to_pylist():
+                yield row["patient_id"], row
+
+def merge_arrow(paths, output_path, batch_rows=10_000):
+    import pyarrow as pa
+
+    schemas = []
+    for path in paths:
+        with pa.memory_map(path) as f:
+            schemas.append(pa.ipc.open_file(f).schema)
+    if any(schema != schemas[0] for schema in schemas):
+        raise ValueError("Shard outputs have different columns")
+
+    with pa.ipc.new_file(output_path, schemas[0]) as writer:
+        batch = []
+        rows = [check_order(arrow_rows(path), path) for path in paths]
+        for patient_id, row in heapq.merge(*rows, key=lambda item: item[0]):
+            batch.append(row)
+            if len(batch) == batch_rows:
+                writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schemas[0]))
+                batch = []
+        if batch:
+            writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schemas[0]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract a cohort in patient shards")
+    parser.add_argument("cohort", help="prevax, vax, unvax or multi")
+    parser.add_argument("--shards", type=int, default=8, help="fixed, so the shard files do not depend on the machine")
+    parser.add_argument("--workers", type=int, default=None, help="defaults to --shards")
+    parser.add_argument("--format", choices=["csv.gz", "arrow"], default="csv.gz")
+    parser.add_argument("--incremental", action="store_true", help="extract the delta (see incremental.py)")
+    args, ehrql_args = parser.parse_known_args()
+
+    definition_args = ["--incremental"] if args.incremental else []
+    name = f"{args.cohort}_delta" if args.incremental else args.cohort
+
+    write_shards(args.shards)
+    extract_shards(
+        args.cohort, args.shards, args.workers or args.shards, args.format, ehrql_args, definition_args
+    )
+
+    paths = [shard_output_path(args.cohort, args.shards, shard, args.format) for shard in range(args.shards)]
+    output_path = f"{output_dir}/input_{name}.{args.format}"
+    merge = merge_csv if args.format == "csv.gz" else merge_arrow
+    merge(paths, output_path)
+    shutil.rmtree(shard_dir(args.shards))
+    print(f"Merged {args.shards} shards into {output_path}")
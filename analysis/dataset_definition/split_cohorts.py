@@ -0,0 +1,59 @@
+# Split the output of dataset_definition_multi.py into one input_<cohort> file per cohort
+#
+# Usage: python analysis/dataset_definition/split_cohorts.py <cohort> [<cohort> ...]
+#
+# Columns named <cohort>__<variable> are written to input_<cohort> as <variable>;
+# columns without a cohort prefix are shared and written to every cohort file.
+# Rows are streamed one at a time, so memory use does not grow with the population.
+
+import csv
+import gzip
+import sys
+
+COHORT_SEPARATOR = "__"  # must match dataset_definition_cohorts.COHORT_SEPARATOR
+
+input_path = "output/dataset_definition/input_multi.csv.gz"
+output_path = "output/dataset_definition/input_{cohort}.csv.gz"
+
+def cohort_columns(header, cohort):
+    # Return (indices, names) of the columns belonging to a cohort, keeping the input order
+    indices = []
+    names = []
+    for i, name in enumerate(header):
+        prefix, sep, var_name = name.partition(COHORT_SEPARATOR)
+        if not sep:
+            indices.append(i)
+            names.append(name)
+        elif prefix == cohort:
+            indices.append(i)
+            names.append(var_name)
+    return indices, names
+
+def split_cohorts(cohorts, input_path=input_path, output_path=output_path):
+    with gzip.open(input_path, "rt", newline="") as f_in:
+        reader = csv.reader(f_in)
+        header = next(reader)
+
+        outputs = []
+        try:
+            for cohort in cohorts:
+                if not any(name.startswith(f"{cohort}{COHORT_SEPARATOR}") for name in header):
+                    raise ValueError(f"No columns found for cohort '{cohort}' in {input_path}")
+                indices, names = cohort_columns(header, cohort)
+                f_out = gzip.open(output_path.format(cohort=cohort), "wt", newline="")
+                writer = csv.writer(f_out, lineterminator="\n")
+                writer.writerow(names)
+                outputs.append((f_out, writer, indices))
+
+            for row in reader:
+                for _, writer, indices in outputs:
+                    writer.writerow([row[i] for i in indices])
+        finally:
+            for f_out, _, _ in outputs:
+                f_out.close()
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) == 0:
+        args = ["prevax", "vax", "unvax"]
+    split_cohorts(args)
@@ -0,0 +1,66 @@
+import json
+
+import codelist_bundle
+from codelist_bundle import bundle_version, check_bundle, file_state, is_current
+
+
+def write_bundle(path, entries):
+    path.write_text(json.dumps(dict(version=bundle_version, entries=entries)))
+
+
+def entry(filename, **state):
+    return dict(filename=filename, column="code", category_column=None, codelist=["A"], **state)
+
+
+def test_is_current_compares_the_csv_contents(tmp_path):
+    csv_path = tmp_path / "codelist.csv"
+    csv_path.write_text("code\nA\n")
+    built = entry(str(csv_path), **file_state(str(csv_path)))
+
+    assert is_current(built, file_state(str(csv_path)))
+    # Same size, different contents
+    csv_path.write_text("code\nB\n")
+    assert not is_current(built, file_state(str(csv_path)))
+    assert not is_current(None, file_state(str(csv_path)))
+
+
+def test_check_bundle(tmp_path):
+    current = tmp_path / "current.csv"
+    changed = tmp_path / "changed.csv"
+    current.write_text("code\nA\n")
+    changed.write_text("code\nA\n")
+    bundle_path = tmp_path / "bundle.json"
+    specs = {
+        name: dict(filename=str(tmp_path / f"{name}.csv"), column="code", category_column=None)
+        for name in ["current", "changed", "missing"]
+    }
+    (tmp_path / "missing.csv").write_text("code\nC\n")
+
+    assert check_bundle(specs, path=str(bundle_path)) == [f"{bundle_path} does not exist"]
+
+    write_bundle(bundle_path, [
+        entry(str(current), **file_state(str(current))),
+        entry(str(changed), **file_state(str(changed))),
+    ])
+    changed.write_text("code\nB\n")
+
+    assert check_bundle(specs, path=str(bundle_path)) == [
+        f"changed: {changed} has changed since the bundle was built",
+        f"missing: {tmp_path / 'missing.csv'} is missing from the bundle",
+    ]
+
+
+def test_check_bundle_rejects_an_old_version(tmp_path):
+    bundle_path = tmp_path / "bundle.json"
+    bundle_path.write_text(json.dumps(dict(version=bundle_version - 1, entries=[])))
+
+    assert check_bundle({}, path=str(bundle_path)) == [f"{bundle_path} is not a version {bundle_version} bundle"]
+
+
+def test_load_codelist_reads_a_current_entry_without_ehrql(tmp_path, monkeypatch):
+    csv_path = tmp_path / "codelist.csv"
+    csv_path.write_text("code\nA\n")
+    entries = {(str(csv_path), "code", None): entry(str(csv_path), **file_state(str(csv_path)))}
+    monkeypatch.setattr(codelist_bundle, "_entries", entries)
+
+    assert codelist_bundle.load_codelist(str(csv_path), column="code") == ["A"]
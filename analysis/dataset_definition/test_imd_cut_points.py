@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from imd_cut_points import QuantileSketch, read_imd_cut_points
+
+
+def rank_error(sketch, values, q):
+    # Fraction of values at or below the sketch's quantile, compared with q
+    return abs(np.mean(values <= sketch.quantile(q)) - q)
+
+
+def test_sketch_rank_error_is_bounded():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=200_000)
+    sketch = QuantileSketch(k=200)
+    for batch in np.array_split(values, 37):
+        sketch.update_many(batch)
+
+    assert sketch.count == len(values)
+    assert sum(len(level) for level in sketch.levels) < 3 * sketch.k
+    for q in np.linspace(0.05, 0.95, 19):
+        assert rank_error(sketch, values, q) < 0.02
+
+
+def test_sketch_is_exact_below_capacity():
+    sketch = QuantileSketch(k=200)
+    for value in [5, None, 3, 1, 4, 2]:
+        sketch.update(value)
+
+    assert sketch.count == 5
+    assert sketch.quantiles([0.2, 0.5, 1]) == [1, 3, 5]
+
+
+def test_sketch_is_deterministic():
+    values = np.random.default_rng(1).integers(0, 329, 50_000) * 100
+    cut_points = []
+    for _ in range(2):
+        sketch = QuantileSketch(k=100)
+        sketch.update_many(values)
+        cut_points.append(sketch.cut_points(10))
+    assert cut_points[0] == cut_points[1]
+
+
+def test_cut_points_count_ties_in_the_lower_group():
+    # quantile(0.5) is 100: half of the values are at or below it
+    sketch = QuantileSketch()
+    sketch.update_many(np.array([0, 100, 100, 100, 200, 300]))
+
+    assert sketch.cut_points(2) == [100]
+
+
+def test_read_imd_cut_points(tmp_path):
+    path = tmp_path / "imd_cut_points.json"
+    assert read_imd_cut_points("prevax", 10, path=str(path)) is None
+
+    path.write_text(json.dumps(dict(groups=10, cut_points=dict(prevax=list(range(9))))))
+    assert read_imd_cut_points("prevax", 10, path=str(path)) == list(range(9))
+    with pytest.raises(ValueError):
+        read_imd_cut_points("prevax", 5, path=str(path))
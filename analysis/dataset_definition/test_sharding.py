@@ -0,0 +1,117 @@
+import csv
+import gzip
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+
+import sharding
+
+
+def write_arrow(path, batches, schema):
+    with pa.ipc.new_file(path, schema) as writer:
+        for batch in batches:
+            writer.write_batch(pa.record_batch(batch, schema=schema))
+
+
+def read_arrow(path):
+    with pa.memory_map(str(path)) as f:
+        return pa.ipc.open_file(f).read_all()
+
+
+def test_shard_of_is_stable_and_in_range():
+    assert [sharding.shard_of(patient_id, 8) for patient_id in range(100)] == [
+        sharding.shard_of(patient_id, 8) for patient_id in range(100)
+    ]
+    assert {sharding.shard_of(patient_id, 8) for patient_id in range(1000)} == set(range(8))
+
+
+def test_write_shards_partitions_every_patient_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    source = tmp_path / "index_dates.arrow"
+    patient_ids = list(range(1, 1001, 3))
+    schema = pa.schema([("patient_id", pa.int64())])
+    write_arrow(str(source), [[patient_ids[:150]], [patient_ids[150:]]], schema)
+
+    sharding.write_shards(4, source=str(source))
+
+    seen = []
+    for shard in range(4):
+        table = read_arrow(sharding.shard_path(4, shard))
+        shard_patient_ids = table.column("patient_id").to_pylist()
+        assert table.column("shard").to_pylist() == [shard] * len(shard_patient_ids)
+        assert all(sharding.shard_of(patient_id, 4) == shard for patient_id in shard_patient_ids)
+        seen += shard_patient_ids
+    assert sorted(seen) == patient_ids
+
+
+def write_csv_gz(path, header, rows):
+    with gzip.open(path, "wt", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def split_by_shard(patient_ids, shards):
+    by_shard = [[] for shard in range(shards)]
+    for patient_id in patient_ids:
+        by_shard[sharding.shard_of(patient_id, shards)].append(patient_id)
+    return by_shard
+
+
+def test_merge_csv_restores_patient_order(tmp_path):
+    patient_ids = list(range(1, 500))
+    paths = []
+    for shard, shard_patient_ids in enumerate(split_by_shard(patient_ids, 3)):
+        path = tmp_path / f"shard_{shard}.csv.gz"
+        write_csv_gz(path, ["patient_id", "value"], [[p, f"v{p}"] for p in shard_patient_ids])
+        paths.append(str(path))
+    output_path = tmp_path / "merged.csv.gz"
+
+    sharding.merge_csv(paths, str(output_path))
+
+    with gzip.open(output_path, "rt", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["patient_id", "value"]
+    assert rows[1:] == [[str(p), f"v{p}"] for p in patient_ids]
+
+
+def test_merge_csv_rejects_unordered_shard(tmp_path):
+    paths = [str(tmp_path / "a.csv.gz"), str(tmp_path / "b.csv.gz")]
+    write_csv_gz(paths[0], ["patient_id"], [[1], [3]])
+    write_csv_gz(paths[1], ["patient_id"], [[4], [2]])
+
+    with pytest.raises(ValueError, match="not in patient order"):
+        sharding.merge_csv(paths, str(tmp_path / "merged.csv.gz"))
+
+
+def test_merge_csv_rejects_different_columns(tmp_path):
+    paths = [str(tmp_path / "a.csv.gz"), str(tmp_path / "b.csv.gz")]
+    write_csv_gz(paths[0], ["patient_id", "a"], [[1, "x"]])
+    write_csv_gz(paths[1], ["patient_id", "b"], [[2, "y"]])
+
+    with pytest.raises(ValueError, match="different columns"):
+        sharding.merge_csv(paths, str(tmp_path / "merged.csv.gz"))
+
+
+def test_merge_arrow_restores_patient_order(tmp_path):
+    patient_ids = list(range(1, 500))
+    schema = pa.schema([("patient_id", pa.int64()), ("value", pa.float64())])
+    paths = []
+    for shard, shard_patient_ids in enumerate(split_by_shard(patient_ids, 3)):
+        path = str(tmp_path / f"shard_{shard}.arrow")
+        half = len(shard_patient_ids) // 2
+        write_arrow(path, [
+            [shard_patient_ids[:half], [p / 2 for p in shard_patient_ids[:half]]],
+            [shard_patient_ids[half:], [p / 2 for p in shard_patient_ids[half:]]],
+        ], schema)
+        paths.append(path)
+    output_path = tmp_path / "merged.arrow"
+
+    sharding.merge_arrow(paths, str(output_path), batch_rows=64)
+
+    merged = read_arrow(output_path)
+    assert merged.schema == schema
+    assert merged.num_rows == len(patient_ids)
+    assert merged.column("patient_id").to_pylist() == patient_ids
+    assert merged.column("value").to_pylist() == [p / 2 for p in patient_ids]
@@ -0,0 +1,56 @@
+import csv
+import gzip
+
+import pytest
+
+from split_cohorts import cohort_columns, split_cohorts
+
+
+def write_csv_gz(path, header, rows):
+    with gzip.open(path, "wt", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def read_csv_gz(path):
+    with gzip.open(path, "rt", newline="") as f:
+        return list(csv.reader(f))
+
+
+def test_cohort_columns_keep_shared_columns_and_strip_prefix():
+    header = ["patient_id", "prevax__index_date", "vax__index_date", "cov_cat_sex", "prevax__out"]
+
+    assert cohort_columns(header, "prevax") == ([0, 1, 3, 4], ["patient_id", "index_date", "cov_cat_sex", "out"])
+    assert cohort_columns(header, "vax") == ([0, 2, 3], ["patient_id", "index_date", "cov_cat_sex"])
+
+
+def test_split_cohorts_writes_one_file_per_cohort(tmp_path):
+    input_path = tmp_path / "input_multi.csv.gz"
+    output_path = str(tmp_path / "input_{cohort}.csv.gz")
+    write_csv_gz(
+        input_path,
+        ["patient_id", "prevax__index_date", "vax__index_date", "cov_cat_sex"],
+        [[1, "2020-01-01", "2021-06-01", "female"], [2, "2020-01-01", "", "male"]],
+    )
+
+    split_cohorts(["prevax", "vax"], input_path=str(input_path), output_path=output_path)
+
+    assert read_csv_gz(output_path.format(cohort="prevax")) == [
+        ["patient_id", "index_date", "cov_cat_sex"],
+        ["1", "2020-01-01", "female"],
+        ["2", "2020-01-01", "male"],
+    ]
+    assert read_csv_gz(output_path.format(cohort="vax")) == [
+        ["patient_id", "index_date", "cov_cat_sex"],
+        ["1", "2021-06-01", "female"],
+        ["2", "", "male"],
+    ]
+
+
+def test_split_cohorts_rejects_unknown_cohort(tmp_path):
+    input_path = tmp_path / "input_multi.csv.gz"
+    write_csv_gz(input_path, ["patient_id", "prevax__index_date"], [[1, "2020-01-01"]])
+
+    with pytest.raises(ValueError, match="unvax"):
+        split_cohorts(["unvax"], input_path=str(input_path), output_path=str(tmp_path / "input_{cohort}.csv.gz"))
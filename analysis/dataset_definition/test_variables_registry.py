@@ -0,0 +1,90 @@
+import datetime
+
+import pytest
+
+ehrql = pytest.importorskip("ehrql")
+
+from ehrql import minimum_of
+from ehrql.tables.tpp import clinical_events
+
+import variables_registry
+from variables_registry import load_registry, match_features, registry_features, registry_variables
+
+index_date = datetime.date(2020, 1, 1)
+end_date_out = datetime.date(2021, 12, 31)
+
+# Outcome and cov_bin_* columns of the hand-written baseline, in output order
+baseline_outcomes = [
+    f"{prefix}_{outcome}{suffix}"
+    for outcome in ["pneumonia", "asthma", "copd", "ild"]
+    for prefix, suffix in [
+        ("tmp_out_date", "_gp"),
+        ("tmp_out_date", "_apc"),
+        ("tmp_out_date", "_death"),
+        ("out_date", ""),
+    ]
+]
+baseline_core_covariates = [
+    "cov_bin_dementia",
+    "cov_bin_liver_disease",
+    "cov_bin_ckd",
+    "cov_bin_cancer",
+    "cov_bin_hypertension",
+    "cov_bin_diabetes",
+    "cov_bin_obesity",
+    "cov_bin_copd",
+    "cov_bin_ami",
+    "cov_bin_stroke_isch",
+    "cov_bin_depression",
+]
+baseline_project_covariates = ["cov_bin_pneumonia", "cov_bin_asthma", "cov_bin_ild"]
+
+
+@pytest.fixture(scope="module")
+def registry():
+    return load_registry()
+
+
+def test_registry_features_match_the_baseline(registry):
+    features = registry_features(registry, index_date, end_date_out)
+
+    assert list(features) == variables_registry.sources
+    assert list(features["gp"]) == [
+        "out_pneumonia", "out_asthma", "out_ild",
+        *(name for name in baseline_core_covariates + baseline_project_covariates if name != "cov_bin_copd"),
+    ]
+    # COPD is coded in CTV3 in primary care
+    assert list(features["gp_ctv3"]) == ["out_copd", "cov_bin_copd"]
+    assert list(features["med"]) == ["cov_bin_hypertension", "cov_bin_diabetes"]
+    assert list(features["apc"]) == [
+        "out_pneumonia", "out_asthma", "out_copd", "out_ild",
+        *baseline_core_covariates, *baseline_project_covariates,
+    ]
+    assert list(features["death"]) == ["out_pneumonia", "out_asthma", "out_copd", "out_ild"]
+
+
+def test_registry_variables_match_the_baseline(registry):
+    matched = match_features(registry_features(registry, index_date, end_date_out))
+
+    variables = registry_variables(registry, matched)
+
+    assert list(variables["outcomes"]) == baseline_outcomes
+    assert list(variables["core_covariates"]) == baseline_core_covariates
+    assert list(variables["project_covariates"]) == baseline_project_covariates
+
+
+def test_gp_and_gp_ctv3_give_one_gp_date():
+    registry = dict(
+        outcomes=dict(copd=dict(gp=["copd_snomed"], gp_ctv3=["copd_ctv3"])),
+        core_covariates={},
+        project_covariates={},
+    )
+    gp = clinical_events.where(clinical_events.snomedct_code.is_in(["13645005"])).sort_by(clinical_events.date).first_for_patient()
+    gp_ctv3 = clinical_events.where(clinical_events.ctv3_code.is_in(["H3y.."])).sort_by(clinical_events.date).first_for_patient()
+    matched = dict(gp=dict(out_copd=gp), gp_ctv3=dict(out_copd=gp_ctv3))
+
+    outcomes = registry_variables(registry, matched)["outcomes"]
+
+    assert list(outcomes) == ["tmp_out_date_copd_gp", "out_date_copd"]
+    assert outcomes["tmp_out_date_copd_gp"]._qm_node == minimum_of(gp.date, gp_ctv3.date)._qm_node
+    assert outcomes["out_date_copd"]._qm_node == outcomes["tmp_out_date_copd_gp"]._qm_node
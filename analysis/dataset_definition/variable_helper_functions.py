@@ -9,6 +9,8 @@ from ehrql.tables.tpp import (
     ons_deaths,
     emergency_care_attendances,
     ethnicity_from_sus,
+    practice_registrations,
+    vaccinations,
 )
 
 def ever_matching_event_clinical_ctv3_before(codelist, start_date, where=True):
@@ -46,14 +48,9 @@ def last_matching_med_dmd_before(codelist, start_date, where=True):
     )
 
 def last_matching_event_apc_before(codelist, start_date, only_prim_diagnoses=False, where=True):
-    query = apcs.where(where).where(apcs.admission_date.is_before(start_date))
-    if only_prim_diagnoses:
-        query = query.where(
-            apcs.primary_diagnosis.is_in(codelist)
-        )
-    else:
-        query = query.where(apcs.all_diagnoses.contains_any_of(codelist))
-    return query.sort_by(apcs.admission_date).last_for_patient()
+    return matching_events_apc_batch(
+        dict(apc=(codelist, ("before", start_date), "last")), only_prim_diagnoses, where
+    )["apc"]
 
 # helper function
 def any_of(conditions):
@@ -73,9 +70,7 @@ def last_matching_event_ec_snomed_before(codelist, start_date, where=True):
     )
 
 def matching_death_before(codelist, start_date, where=True):
-    return(
-        ons_deaths.cause_of_death_is_in(codelist)  & ons_deaths.date.is_before(start_date)
-    )
+    return matching_deaths_batch(dict(death=(codelist, ("before", start_date))))["death"]
 
 def last_matching_event_clinical_snomed_between(codelist, start_date, end_date, where=True):
     return(
@@ -123,14 +118,9 @@ def first_matching_med_dmd_between(codelist, start_date, end_date, where=True):
     )
 
 def first_matching_event_apc_between(codelist, start_date, end_date, only_prim_diagnoses=False, where=True):
-    query = apcs.where(where).where(apcs.admission_date.is_on_or_between(start_date, end_date))
-    if only_prim_diagnoses:
-        query = query.where(
-            apcs.primary_diagnosis.is_in(codelist)
-        )
-    else:
-        query = query.where(apcs.all_diagnoses.contains_any_of(codelist))
-    return query.sort_by(apcs.admission_date).first_for_patient()
+    return matching_events_apc_batch(
+        dict(apc=(codelist, ("between", start_date, end_date), "first")), only_prim_diagnoses, where
+    )["apc"]
 
 def first_matching_event_ec_snomed_between(codelist, start_date, end_date, where=True):
     conditions = [
@@ -146,80 +136,180 @@ def first_matching_event_ec_snomed_between(codelist, start_date, end_date, where
     )
 
 def matching_death_between(codelist, start_date, end_date, where=True):
-    return(
-        ons_deaths.cause_of_death_is_in(codelist) & ons_deaths.date.is_on_or_between(start_date, end_date)
-    )
+    return matching_deaths_batch(dict(death=(codelist, ("between", start_date, end_date))))["death"]
+
+# date condition for a window given as ("before", date), ("on_or_before", date) or ("between", start_date, end_date)
+def window_condition(date_column, window):
+    window_type, *dates = window
+    if window_type == "before":
+        return date_column.is_before(*dates)
+    elif window_type == "on_or_before":
+        return date_column.is_on_or_before(*dates)
+    elif window_type == "between":
+        return date_column.is_on_or_between(*dates)
+    raise ValueError(f"Unknown window type: {window_type}")
+
+# compute several features of an event table (with a date column) in one call
+# features is a dict of feature name -> (codelist, window, kind), where kind is "first", "last" or "exists"
+# "first"/"last" return the same patient frame as first_matching_*/last_matching_* (so .date etc. can be used),
+# "exists" returns a boolean series
+def matching_events_batch(table, code_column, features, where=True):
+    events = table.where(where)
+    codes = getattr(table, code_column)
+    results = {}
+    for name, (codelist, window, kind) in features.items():
+        query = (
+            events.where(codes.is_in(codelist))
+            .where(window_condition(table.date, window))
+        )
+        if kind == "exists":
+            results[name] = query.exists_for_patient()
+        elif kind == "first":
+            results[name] = query.sort_by(table.date).first_for_patient()
+        elif kind == "last":
+            results[name] = query.sort_by(table.date).last_for_patient()
+        else:
+            raise ValueError(f"Unknown kind for {name}: {kind}")
+    return results
+
+def matching_events_clinical_batch(features, code_column="snomedct_code", where=True):
+    return matching_events_batch(clinical_events, code_column, features, where)
+
+def matching_events_med_batch(features, where=True):
+    return matching_events_batch(medications, "dmd_code", features, where)
+
+# classify each death against several ICD-10 codelists, with cause_of_death_is_in for each codelist
+# features is a dict of feature name -> (codelist, window), with windows as in window_condition
+# a boolean series is returned per feature, e.g. for case(when(deaths["pneumonia"]).then(ons_deaths.date))
+def matching_deaths_batch(features):
+    return {
+        name: ons_deaths.cause_of_death_is_in(codelist) & window_condition(ons_deaths.date, window)
+        for name, (codelist, window) in features.items()
+    }
+
+# reduce a codelist to the codes that do not extend another code in it:
+# a substring match on all_diagnoses for "J12" already matches "J120", so "J120" adds nothing
+def prefix_free_codes(codelist):
+    codes = []
+    for code in sorted(set(str(code) for code in codelist)):
+        if not codes or not code.startswith(codes[-1]):
+            codes.append(code)
+    return codes
+
+# compute several apcs features (ICD-10 codelists) at once, with the same features as matching_events_clinical_batch
+# all_diagnoses is searched for each codelist's prefix-free codes; with only_prim_diagnoses=True,
+# primary_diagnosis is matched against the codelist instead
+def matching_events_apc_batch(features, only_prim_diagnoses=False, where=True):
+    spells = apcs.where(where)
+    if only_prim_diagnoses:
+        conditions = {
+            name: apcs.primary_diagnosis.is_in(codelist)
+            for name, (codelist, window, kind) in features.items()
+        }
+    else:
+        conditions = {
+            name: apcs.all_diagnoses.contains_any_of(prefix_free_codes(codelist))
+            for name, (codelist, window, kind) in features.items()
+        }
+    results = {}
+    for name, (codelist, window, kind) in features.items():
+        query = spells.where(conditions[name]).where(window_condition(apcs.admission_date, window))
+        if kind == "exists":
+            results[name] = query.exists_for_patient()
+        elif kind == "first":
+            results[name] = query.sort_by(apcs.admission_date).first_for_patient()
+        elif kind == "last":
+            results[name] = query.sort_by(apcs.admission_date).last_for_patient()
+        else:
+            raise ValueError(f"Unknown kind for {name}: {kind}")
+    return results
+
+# first deregistration date after each of several index dates
+# index_dates is a dict of name -> date; returns name -> the first registration end date on or after that date
+# (the minimum end date, rather than sorting each patient's registrations); there is one query per date
+def first_deregistration_dates(index_dates):
+    ended = practice_registrations.where(practice_registrations.end_date.is_not_null())
+    return {
+        name: ended.where(practice_registrations.end_date.is_on_or_after(index_date))
+        .end_date.minimum_for_patient()
+        for name, index_date in index_dates.items()
+    }
+
+# dates of the first n doses for several groups of vaccinations
+# groups is a dict of group name -> condition on vaccinations; dose k is the first vaccination
+# of the group after dose k-1 (dose 1 is the first on or after earliest_date)
+# returns a dict of "{group}_{k}" -> dose date
+def vaccination_doses(groups, earliest_date, doses=3):
+    results = {}
+    for name, condition in groups.items():
+        group_vaccinations = vaccinations.where(condition)
+        previous_date = None
+        for dose in range(1, doses + 1):
+            if previous_date is None:
+                dose_vaccinations = group_vaccinations.where(vaccinations.date.is_on_or_after(earliest_date))
+            else:
+                dose_vaccinations = group_vaccinations.where(vaccinations.date.is_after(previous_date))
+            previous_date = dose_vaccinations.sort_by(vaccinations.date).first_for_patient().date
+            results[f"{name}_{dose}"] = previous_date
+    return results
 
 # filter a codelist based on whether its values included a specified set of allowed values (include)
 def filter_codes_by_category(codelist, include):
     return {k:v for k,v in codelist.items() if v in include}
 
+# map the values of a series to labels with a single lookup, rather than a case(when(...)) branch per value
+# mapping is a dict of value -> label; values not in the mapping (and nulls) are given default
+# if codelist (a dict of code -> category) is given, series is a code series and mapping is keyed by category:
+# the two are composed into one code -> label categorisation, so the codes are only looked up once
+def map_categories(series, mapping, codelist=None, default=None):
+    if codelist is None:
+        return series.map_values(mapping, default=default)
+    labelled = series.to_category(
+        {code: mapping[category] for code, category in codelist.items() if category in mapping}
+    )
+    if default is None:
+        return labelled
+    return case(when(labelled.is_not_null()).then(labelled), otherwise=default)
+
+# ethnicity labels by grouping, keyed by the primary care category and by the SUS ethnic category code
+ethnicity_groups = {
+    6: ["White", "Mixed", "Asian", "Black", "Other"],
+    16: [
+        "White British", "White Irish", "Other White",
+        "White and Caribbean", "White and African", "White and Asian", "Other Mixed",
+        "Indian", "Pakistani", "Bangladeshi", "Other Asian",
+        "Caribbean", "African", "Other Black",
+        "Chinese", "All other ethnic groups",
+    ],
+}
+
+# SUS codes in the 16-group order; the 6-group labels each cover consecutive codes
+ethnicity_sus_codes = ["A", "B", "C", "D", "E", "F", "G", "H", "J", "K", "L", "M", "N", "P", "R", "S"]
+ethnicity_sus_group_6 = ["White"] * 3 + ["Mixed"] * 4 + ["Asian"] * 4 + ["Black"] * 3 + ["Other"] * 2
+
+def ethnicity_labels(grouping):
+    if grouping not in ethnicity_groups:
+        raise ValueError(f"Unknown ethnicity grouping: {grouping}")
+    codes_labels = {str(i + 1): label for i, label in enumerate(ethnicity_groups[grouping])}
+    sus_labels = ethnicity_groups[16] if grouping == 16 else ethnicity_sus_group_6
+    return codes_labels, dict(zip(ethnicity_sus_codes, sus_labels))
+
 # get the latest ethnicity code from primary care records, categorise it, and combine it with SUS secondary care records
 def get_latest_ethnicity(
         index_date, codelist, grouping=6
     ):
-        latest_ethnicity_from_codes_category_num = (
+        codes_labels, sus_labels = ethnicity_labels(grouping)
+
+        latest_ethnicity_code = (
             clinical_events.where(clinical_events.snomedct_code.is_in(codelist))
             .where(clinical_events.date.is_on_or_before(index_date))
             .sort_by(clinical_events.date)
             .last_for_patient()
-            .snomedct_code.to_category(codelist)
+            .snomedct_code
         )
 
-        if grouping == 6:
-            latest_ethnicity_from_codes = case(
-                when(latest_ethnicity_from_codes_category_num == "1").then("White"),
-                when(latest_ethnicity_from_codes_category_num == "2").then("Mixed"),
-                when(latest_ethnicity_from_codes_category_num == "3").then("Asian"),
-                when(latest_ethnicity_from_codes_category_num == "4").then("Black"),
-                when(latest_ethnicity_from_codes_category_num == "5").then("Other"),
-            )
-
-            ethnicity_sus = case(
-                when(ethnicity_from_sus.code.is_in(["A", "B", "C"])).then("White"),
-                when(ethnicity_from_sus.code.is_in(["D", "E", "F", "G"])).then("Mixed"),
-                when(ethnicity_from_sus.code.is_in(["H", "J", "K", "L"])).then("Asian"),
-                when(ethnicity_from_sus.code.is_in(["M", "N", "P"])).then("Black"),
-                when(ethnicity_from_sus.code.is_in(["R", "S"])).then("Other"),
-            )
-        elif grouping == 16:
-            latest_ethnicity_from_codes = case(
-                when(latest_ethnicity_from_codes_category_num == "1").then("White British"),
-                when(latest_ethnicity_from_codes_category_num == "2").then("White Irish"),
-                when(latest_ethnicity_from_codes_category_num == "3").then("Other White"),
-                when(latest_ethnicity_from_codes_category_num == "4").then("White and Caribbean"),
-                when(latest_ethnicity_from_codes_category_num == "5").then("White and African"),
-                when(latest_ethnicity_from_codes_category_num == "6").then("White and Asian"),
-                when(latest_ethnicity_from_codes_category_num == "7").then("Other Mixed"),
-                when(latest_ethnicity_from_codes_category_num == "8").then("Indian"),
-                when(latest_ethnicity_from_codes_category_num == "9").then("Pakistani"),
-                when(latest_ethnicity_from_codes_category_num == "10").then("Bangladeshi"),
-                when(latest_ethnicity_from_codes_category_num == "11").then("Other Asian"),
-                when(latest_ethnicity_from_codes_category_num == "12").then("Caribbean"),
-                when(latest_ethnicity_from_codes_category_num == "13").then("African"),
-                when(latest_ethnicity_from_codes_category_num == "14").then("Other Black"),
-                when(latest_ethnicity_from_codes_category_num == "15").then("Chinese"),
-                when(latest_ethnicity_from_codes_category_num == "16").then("All other ethnic groups"),
-            )
-
-            ethnicity_sus = case(
-                when(ethnicity_from_sus.code == "A").then("White British"),
-                when(ethnicity_from_sus.code == "B").then("White Irish"),
-                when(ethnicity_from_sus.code == "C").then("Other White"),
-                when(ethnicity_from_sus.code == "D").then("White and Caribbean"),
-                when(ethnicity_from_sus.code == "E").then("White and African"),
-                when(ethnicity_from_sus.code == "F").then("White and Asian"),
-                when(ethnicity_from_sus.code == "G").then("Other Mixed"),
-                when(ethnicity_from_sus.code == "H").then("Indian"),
-                when(ethnicity_from_sus.code == "J").then("Pakistani"),
-                when(ethnicity_from_sus.code == "K").then("Bangladeshi"),
-                when(ethnicity_from_sus.code == "L").then("Other Asian"),
-                when(ethnicity_from_sus.code == "M").then("Caribbean"),
-                when(ethnicity_from_sus.code == "N").then("African"),
-                when(ethnicity_from_sus.code == "P").then("Other Black"),
-                when(ethnicity_from_sus.code == "R").then("Chinese"),
-                when(ethnicity_from_sus.code == "S").then("All other ethnic groups"),
-            )
+        latest_ethnicity_from_codes = map_categories(latest_ethnicity_code, codes_labels, codelist=codelist)
+        ethnicity_sus = map_categories(ethnicity_from_sus.code, sus_labels)
 
         ethnicity_combined = case(
             when(latest_ethnicity_from_codes.is_not_null()).then(
@@ -234,29 +324,28 @@ def get_latest_ethnicity(
         return ethnicity_combined
 
 # helper function to categorise IMD into groups (e.g. quintiles, deciles) based on the distribution of IMD in the dataset
+# cut_points are the groups - 1 boundaries between groups, e.g. from imd_cut_points.py; a patient with IMD
+# equal to a cut point is in the group below it. Without them the groups are equal steps up to max_imd, each
+# including its lower bound as before. imd can be passed when already extracted (e.g. by the dates stage)
 
-def get_imd(index_date, groups=5, max_imd=32844):
-    step = max_imd / groups
-    whens = []
-
-    imd = addresses.for_patient_on(index_date).imd_rounded
+def get_imd(index_date, groups=5, max_imd=32844, cut_points=None, imd=None):
+    if imd is None:
+        imd = addresses.for_patient_on(index_date).imd_rounded
 
-    for i in range(groups):
-        lower = int(step * i)
-        upper = int(step * (i + 1))
-
-        if i == 0:
-            label = "1 (most deprived)"
-        elif i == groups - 1:
-            label = f"{groups} (least deprived)"
-        else:
-            label = str(i + 1)
+    if cut_points is None:
+        step = max_imd / groups
+        # imd_rounded is a whole number, so imd < int(step * i) is imd <= int(step * i) - 1
+        cut_points = [int(step * i) - 1 for i in range(1, groups)]
+    elif len(cut_points) != groups - 1:
+        raise ValueError(f"Expected {groups - 1} IMD cut points, got {len(cut_points)}")
 
-        condition = (imd >= lower) & (imd < upper)
-        whens.append(when(condition).then(label))
+    labels = ["1 (most deprived)"] + [str(i + 1) for i in range(1, groups - 1)] + [f"{groups} (least deprived)"]
 
-    imd_grouped=case(
-        *whens,
+    # the cut points are increasing, so each group only needs to test its upper bound
+    imd_grouped = case(
+        when(imd < 0).then("unknown"),
+        *[when(imd <= upper).then(label) for upper, label in zip(cut_points, labels)],
+        when(imd < max_imd).then(labels[-1]),
         otherwise="unknown",
     )
 
@@ -19,31 +19,53 @@ from ehrql.tables.tpp import (
     ons_deaths,
 )
 
-# Codelists from codelists.py (which pulls all variables from the codelist folder)
-from codelists import *
+# Codelists from codelists.py (only the codelists imported here, and those named in variables_registry.json, are loaded)
+from codelists import (
+    covid_codes,
+    covid_primary_care_positive_test,
+    covid_primary_care_code,
+    covid_primary_care_sequalae,
+    ethnicity_snomed,
+    smoking_clear,
+    prostate_cancer_snomed,
+    prostate_cancer_icd10,
+    pregnancy_snomed,
+    cocp_dmd,
+    hrt_dmd,
+    asthma_snomed,
+    asthma_icd10,
+)
+
+# Outcomes and covariates declared in variables_registry.json
+from variables_registry import (
+    load_registry,
+    registry_features,
+    match_features,
+    registry_variables,
+)
 
 # Call functions from variable_helper_functions
 from variable_helper_functions import (
     ever_matching_event_clinical_ctv3_before,
-    first_matching_event_clinical_ctv3_between,
-    first_matching_event_clinical_snomed_between,
-    first_matching_event_apc_between,
-    matching_death_between,
     last_matching_event_clinical_ctv3_before,
-    last_matching_event_clinical_snomed_before,
     last_matching_med_dmd_before,
-    last_matching_event_apc_before,
-    matching_death_before,
     filter_codes_by_category,
+    first_deregistration_dates,
     get_imd,
     get_latest_ethnicity,
+    map_categories,
 )
 
 # Claim permissions to allow dataset definition to import tables in dummy data
 claim_permissions("sgss_covid_all_tests", "occupation_on_covid_vaccine_record")
 
 # Define generate variables function
-def generate_variables(index_date, end_date_exp, end_date_out):  
+# cens_date_dereg, death_date and imd can be passed from index_dates (see dataset_definition_dates.py);
+# otherwise they are queried from practice_registrations, patients, ons_deaths and addresses.
+# imd_cut_points are the IMD decile boundaries from imd_cut_points.py, if they have been computed
+def generate_variables(
+    index_date, end_date_exp, end_date_out, cens_date_dereg=None, death_date=None, imd=None, imd_cut_points=None
+):  
 
     ## Inclusion/exclusion criteria------------------------------------------------------------------------
 
@@ -53,19 +75,48 @@ def generate_variables(index_date, end_date_exp, end_date_out):
         )).exists_for_patient()
 
     ### Alive on the index date
-    inex_bin_alive = (((patients.date_of_death.is_null()) | (patients.date_of_death.is_after(index_date))) & 
-    ((ons_deaths.date.is_null()) | (ons_deaths.date.is_after(index_date))))
+    if death_date is None:
+        inex_bin_alive = (((patients.date_of_death.is_null()) | (patients.date_of_death.is_after(index_date))) & 
+        ((ons_deaths.date.is_null()) | (ons_deaths.date.is_after(index_date))))
+    else:
+        # death_date is the earliest of the two death dates, so this is equivalent to the above
+        inex_bin_alive = death_date.is_null() | death_date.is_after(index_date)
 
     ## Censoring criteria----------------------------------------------------------------------------------
 
     ### Deregistered
-    cens_date_dereg = (
-        practice_registrations.where(practice_registrations.end_date.is_not_null())
-        .where(practice_registrations.end_date.is_on_or_after(index_date))
-        .sort_by(practice_registrations.end_date)
-        .first_for_patient()
-        .end_date
+    if cens_date_dereg is None:
+        cens_date_dereg = first_deregistration_dates(dict(cens_date_dereg = index_date))["cens_date_dereg"]
+
+    ## Registered outcomes and covariates------------------------------------------------------------------
+
+    ### Outcomes and cov_bin_* covariates are declared in variables_registry.json and compiled into one
+    ### query per entry and source, together with the other codelist features added below
+    registry = load_registry()
+    features = registry_features(registry, index_date, end_date_out)
+
+    ### Exposures
+    features["death"].update(
+        exp_covid = (covid_codes, ("between", index_date, end_date_exp)),
+    )
+    ### Quality assurance
+    features["gp"].update(
+        qa_bin_prostate_cancer = (prostate_cancer_snomed, ("before", index_date), "exists"),
+        qa_bin_pregnancy = (pregnancy_snomed, ("before", index_date), "exists"),
+    )
+    features["apc"].update(
+        qa_bin_prostate_cancer = (prostate_cancer_icd10, ("before", index_date), "exists"),
+    )
+    ### Subgroups
+    features["gp"].update(
+        sub_bin_asthma_recent = (asthma_snomed, ("between", index_date - days(730), index_date - days(1)), "exists"),
     )
+    features["apc"].update(
+        sub_bin_asthma_recent = (asthma_icd10, ("between", index_date - days(730), index_date - days(1)), "exists"),
+    )
+
+    matched = match_features(features)
+    registered = registry_variables(registry, matched)
 
     ## Exposures-------------------------------------------------------------------------------------------
 
@@ -101,7 +152,7 @@ def generate_variables(index_date, end_date_exp, end_date_out):
         .first_for_patient()
         .admission_date
     )
-    tmp_exp_covid_death = matching_death_between(covid_codes, index_date, end_date_exp)
+    tmp_exp_covid_death = matched["death"]["exp_covid"]
     tmp_exp_date_death = ons_deaths.date
     tmp_exp_date_covid_death = case(
         when(tmp_exp_covid_death).then(tmp_exp_date_death)
@@ -118,121 +169,18 @@ def generate_variables(index_date, end_date_exp, end_date_out):
 
     ### Prostate cancer
     qa_bin_prostate_cancer = (
-        (last_matching_event_clinical_snomed_before(
-            prostate_cancer_snomed, index_date
-        ).exists_for_patient()) |
-        (last_matching_event_apc_before(
-            prostate_cancer_icd10, index_date
-        ).exists_for_patient())
+        matched["gp"]["qa_bin_prostate_cancer"] |
+        matched["apc"]["qa_bin_prostate_cancer"]
     )
 
     ### Pregnancy
-    qa_bin_pregnancy = last_matching_event_clinical_snomed_before(
-        pregnancy_snomed, index_date
-    ).exists_for_patient()
-
-    ### Year of birth
-    qa_num_birth_year = patients.date_of_birth.year
+    qa_bin_pregnancy = matched["gp"]["qa_bin_pregnancy"]
 
     ## COCP or heart medication
     qa_bin_hrtcocp = last_matching_med_dmd_before(
         cocp_dmd + hrt_dmd, index_date
     ).exists_for_patient()
 
-    ## Outcomes--------------------------------------------------------------------------------------------
-
-    ### Pneumonia
-    tmp_out_date_pneumonia_gp = (
-        first_matching_event_clinical_snomed_between(
-            pneumonia_snomed, index_date, end_date_out
-            ).date
-    )
-    tmp_out_date_pneumonia_apc = (
-        first_matching_event_apc_between(
-            pneumonia_icd10, index_date, end_date_out
-            ).admission_date
-    )
-    tmp_out_date_pneumonia_death = case(
-        when(
-            matching_death_between(pneumonia_icd10, index_date, end_date_out)
-            ).then(ons_deaths.date)
-    )
-
-    out_date_pneumonia = minimum_of(
-        tmp_out_date_pneumonia_gp,
-        tmp_out_date_pneumonia_apc,
-        tmp_out_date_pneumonia_death
-    )
-
-    ### Asthma
-    tmp_out_date_asthma_gp = (
-        first_matching_event_clinical_snomed_between(
-            asthma_snomed, index_date, end_date_out
-            ).date
-    )
-    tmp_out_date_asthma_apc = (
-        first_matching_event_apc_between(
-            asthma_icd10, index_date, end_date_out
-            ).admission_date
-    )
-    tmp_out_date_asthma_death = case(
-        when(
-            matching_death_between(asthma_icd10, index_date, end_date_out)
-            ).then(ons_deaths.date)
-    )
-
-    out_date_asthma = minimum_of(
-        tmp_out_date_asthma_gp,
-        tmp_out_date_asthma_apc,
-        tmp_out_date_asthma_death
-    )
-
-    ### COPD   
-    tmp_out_date_copd_gp = (
-        first_matching_event_clinical_ctv3_between(
-            copd_ctv3, index_date, end_date_out
-            ).date
-    )
-    tmp_out_date_copd_apc = (
-        first_matching_event_apc_between(
-            copd_icd10, index_date, end_date_out
-            ).admission_date
-    )
-    tmp_out_date_copd_death = case(
-        when(
-            matching_death_between(copd_icd10, index_date, end_date_out)
-            ).then(ons_deaths.date)
-    )
-
-    out_date_copd = minimum_of(
-        tmp_out_date_copd_gp,
-        tmp_out_date_copd_apc,
-        tmp_out_date_copd_death
-    )
-
-    ### ILD (Interstitial Lung Disease)
-    tmp_out_date_ild_gp = (
-        first_matching_event_clinical_snomed_between(
-            ild_snomed, index_date, end_date_out
-            ).date
-    )
-    tmp_out_date_ild_apc = (
-        first_matching_event_apc_between(
-            ild_icd10, index_date, end_date_out
-            ).admission_date
-    )
-    tmp_out_date_ild_death = case(
-        when(
-            matching_death_between(ild_icd10, index_date, end_date_out)
-            ).then(ons_deaths.date)
-    )
-
-    out_date_ild = minimum_of(
-        tmp_out_date_ild_gp,
-        tmp_out_date_ild_apc,
-        tmp_out_date_ild_death
-    )
-
     ## Strata----------------------------------------------------------------------------------------------
 
     ### Region
@@ -243,29 +191,28 @@ def generate_variables(index_date, end_date_exp, end_date_out):
     ### Age
     cov_num_age = patients.age_on(index_date)
 
-    ### Sex
-    cov_cat_sex = patients.sex
-
     ### Ethnicity
     cov_cat_ethnicity = get_latest_ethnicity(index_date,ethnicity_snomed, grouping=6)
 
     ### Deprivation
-    cov_cat_imd = get_imd(index_date, groups=10, max_imd=32844)
+    cov_cat_imd = get_imd(index_date, groups=10, max_imd=32844, cut_points=imd_cut_points, imd=imd)
 
     ### Smoking status
-    tmp_most_recent_smoking_cat = (
-        last_matching_event_clinical_ctv3_before(smoking_clear, index_date)
-        .ctv3_code.to_category(smoking_clear)
+    # the most recent smoking category, with no record or an unknown category mapped to "M"
+    tmp_most_recent_smoking_cat = map_categories(
+        last_matching_event_clinical_ctv3_before(smoking_clear, index_date).ctv3_code,
+        {"S": "S", "E": "E", "N": "N"},
+        codelist=smoking_clear,
+        default="M",
     )
     tmp_ever_smoked = ever_matching_event_clinical_ctv3_before(
         (filter_codes_by_category(smoking_clear, include=["S", "E"])), index_date
         ).exists_for_patient()
 
+    # never smokers with an earlier current or ex-smoker record are ex-smokers
     cov_cat_smoking = case(
-        when(tmp_most_recent_smoking_cat == "S").then("S"),
-        when((tmp_most_recent_smoking_cat == "E") | ((tmp_most_recent_smoking_cat == "N") & (tmp_ever_smoked == True))).then("E"),
-        when((tmp_most_recent_smoking_cat == "N") & (tmp_ever_smoked == False)).then("N"),
-        otherwise="M"
+        when((tmp_most_recent_smoking_cat == "N") & tmp_ever_smoked).then("E"),
+        otherwise=tmp_most_recent_smoking_cat,
     )
 
     ### Care home status
@@ -275,176 +222,6 @@ def generate_variables(index_date, end_date_exp, end_date_out):
         addresses.for_patient_on(index_date).care_home_does_not_require_nursing
     )
 
-    ### Consultation rate in 2019
-    tmp_cov_num_consrate2019 = appointments.where(
-        appointments.status.is_in([
-            "Arrived",
-            "In Progress",
-            "Finished",
-            "Visit",
-            "Waiting",
-            "Patient Walked Out",
-            ]) & appointments.start_date.is_on_or_between("2019-01-01", "2019-12-31")
-            ).count_for_patient()    
-
-    cov_num_consrate2019 = case(
-        when(tmp_cov_num_consrate2019 <= 365).then(tmp_cov_num_consrate2019),
-        otherwise=365,
-    )
-
-    ### Healthcare worker
-    cov_bin_hcworker = occupation_on_covid_vaccine_record.where(
-        (occupation_on_covid_vaccine_record.is_healthcare_worker == True)
-    ).exists_for_patient()
-
-    ### Dementia
-    cov_bin_dementia = (
-        (last_matching_event_clinical_snomed_before(
-            dementia_snomed + dementia_vascular_snomed, index_date
-        ).exists_for_patient()) |
-        (last_matching_event_apc_before(
-            dementia_icd10 + dementia_vascular_icd10, index_date
-        ).exists_for_patient())
-    )
-
-    ### Liver disease
-    cov_bin_liver_disease = (
-        (last_matching_event_clinical_snomed_before(
-            liver_disease_snomed, index_date
-        ).exists_for_patient()) |
-        (last_matching_event_apc_before(
-            liver_disease_icd10, index_date
-        ).exists_for_patient())
-    )
-
-    ### Chronic kidney disease (CKD)
-    cov_bin_ckd = (
-        (last_matching_event_clinical_snomed_before(
-            ckd_snomed, index_date
-        ).exists_for_patient()) |
-        (last_matching_event_apc_before(
-            ckd_icd10, index_date
-        ).exists_for_patient())
-    )
-
-    ### Cancer
-    cov_bin_cancer = (
-        (last_matching_event_clinical_snomed_before(
-            cancer_snomed, index_date
-        ).exists_for_patient()) |
-        (last_matching_event_apc_before(
-            cancer_icd10, index_date
-        ).exists_for_patient())
-    )
-
-    ### Hypertension
-    cov_bin_hypertension = (
-        (last_matching_event_clinical_snomed_before(
-            hypertension_snomed, index_date
-        ).exists_for_patient()) |
-        (last_matching_med_dmd_before(
-            hypertension_drugs_dmd, index_date
-        ).exists_for_patient()) |
-        (last_matching_event_apc_before(
-            hypertension_icd10, index_date
-        ).exists_for_patient())
-    )
-
-    ### Diabetes 
-    cov_bin_diabetes = (
-        (last_matching_event_clinical_snomed_before(
-            diabetes_snomed, index_date
-        ).exists_for_patient()) |
-        (last_matching_med_dmd_before(
-            diabetes_drugs_dmd, index_date
-        ).exists_for_patient()) |
-        (last_matching_event_apc_before(
-            diabetes_icd10, index_date
-        ).exists_for_patient())
-    )
-
-    ### Obesity 
-    cov_bin_obesity = (
-        (last_matching_event_clinical_snomed_before(
-            bmi_obesity_snomed, index_date
-        ).exists_for_patient()) |
-        (last_matching_event_apc_before(
-            bmi_obesity_icd10, index_date
-        ).exists_for_patient())
-    )
-
-    ### COPD
-    cov_bin_copd = (
-        (last_matching_event_clinical_ctv3_before(
-            copd_ctv3, index_date
-        ).exists_for_patient()) |
-        (last_matching_event_apc_before(
-            copd_icd10, index_date
-        ).exists_for_patient())
-    )
-
-    ### Acute myocardial infarction (AMI)
-    cov_bin_ami = (
-        (last_matching_event_clinical_snomed_before(
-            ami_snomed, index_date
-        ).exists_for_patient()) |
-        (last_matching_event_apc_before(
-            ami_icd10 + ami_prior_icd10, index_date
-        ).exists_for_patient())
-    )
-
-    ### Depression
-    cov_bin_depression = (
-        (last_matching_event_clinical_snomed_before(
-            depression_snomed, index_date
-        ).exists_for_patient()) |
-        (last_matching_event_apc_before(
-            depression_icd10, index_date
-        ).exists_for_patient())
-    )
-
-    ### Ischaemic stroke
-    cov_bin_stroke_isch = (
-        (last_matching_event_clinical_snomed_before(
-            stroke_isch_snomed, index_date
-        ).exists_for_patient()) |
-        (last_matching_event_apc_before(
-            stroke_isch_icd10, index_date
-        ).exists_for_patient())
-    )
-
-    ## Project specific covariates-------------------------------------------------------------------------
-
-    ### Pneumonia
-    cov_bin_pneumonia = (
-        (last_matching_event_clinical_snomed_before(
-            pneumonia_snomed, index_date
-        ).exists_for_patient()) |
-        (last_matching_event_apc_before(
-            pneumonia_icd10, index_date
-        ).exists_for_patient())
-    )
-
-    ### Asthma
-    cov_bin_asthma = (
-        (last_matching_event_clinical_snomed_before(
-            asthma_snomed, index_date
-        ).exists_for_patient()) |
-        (last_matching_event_apc_before(
-            asthma_icd10, index_date
-        ).exists_for_patient())
-    )
-
-    ### Interstitial Lung Disease (ILD)
-    cov_bin_ild = (
-        (last_matching_event_clinical_snomed_before(
-            ild_snomed, index_date
-        ).exists_for_patient()) |
-        (last_matching_event_apc_before(
-            ild_icd10, index_date
-        ).exists_for_patient())
-    )
-
     ## Subgroups-------------------------------------------------------------------------------------------
 
     ### History of COVID-19
@@ -503,16 +280,12 @@ def generate_variables(index_date, end_date_exp, end_date_out):
 
     ### Asthma diagnosed in the past 2 years
     sub_bin_asthma_recent=(
-        (first_matching_event_clinical_snomed_between(
-            asthma_snomed, index_date-days(730), index_date-days(1)
-        ).exists_for_patient()) |
-        (first_matching_event_apc_between(
-            asthma_icd10, index_date-days(730), index_date-days(1)
-        ).exists_for_patient())
+        matched["gp"]["sub_bin_asthma_recent"] |
+        matched["apc"]["sub_bin_asthma_recent"]
     )
 
     ### COPD diagnosed ever     
-    sub_bin_copd_ever = cov_bin_copd
+    sub_bin_copd_ever = registered["core_covariates"]["cov_bin_copd"]
 
     ## Define dictionary of variables to be written into dataset-------------------------------------------
     dynamic_variables = dict(
@@ -526,51 +299,20 @@ def generate_variables(index_date, end_date_exp, end_date_out):
         ### Quality assurance
         qa_bin_prostate_cancer = qa_bin_prostate_cancer,
         qa_bin_pregnancy = qa_bin_pregnancy,
-        qa_num_birth_year = qa_num_birth_year,
         qa_bin_hrtcocp = qa_bin_hrtcocp,
         ### Outcomes (including tmp_* for Venn diagrams)
-        tmp_out_date_pneumonia_gp = tmp_out_date_pneumonia_gp,
-        tmp_out_date_pneumonia_apc = tmp_out_date_pneumonia_apc,
-        tmp_out_date_pneumonia_death = tmp_out_date_pneumonia_death,
-        out_date_pneumonia = out_date_pneumonia,
-        tmp_out_date_asthma_gp = tmp_out_date_asthma_gp,
-        tmp_out_date_asthma_apc = tmp_out_date_asthma_apc,
-        tmp_out_date_asthma_death = tmp_out_date_asthma_death,
-        out_date_asthma = out_date_asthma,
-        tmp_out_date_copd_gp = tmp_out_date_copd_gp,
-        tmp_out_date_copd_apc = tmp_out_date_copd_apc,
-        tmp_out_date_copd_death = tmp_out_date_copd_death,
-        out_date_copd = out_date_copd,
-        tmp_out_date_ild_gp = tmp_out_date_ild_gp,
-        tmp_out_date_ild_apc = tmp_out_date_ild_apc,
-        tmp_out_date_ild_death = tmp_out_date_ild_death,
-        out_date_ild = out_date_ild,
+        **registered["outcomes"],
         ### Strata
         strat_cat_region = strat_cat_region,
         ### Core covariates
         cov_num_age = cov_num_age,
-        cov_cat_sex = cov_cat_sex,
         cov_cat_ethnicity = cov_cat_ethnicity,
         cov_cat_imd = cov_cat_imd,
         cov_cat_smoking = cov_cat_smoking,
         cov_bin_carehome = cov_bin_carehome,
-        cov_num_consrate2019 = cov_num_consrate2019,
-        cov_bin_hcworker = cov_bin_hcworker,
-        cov_bin_dementia = cov_bin_dementia,
-        cov_bin_liver_disease = cov_bin_liver_disease,
-        cov_bin_ckd = cov_bin_ckd,
-        cov_bin_cancer = cov_bin_cancer,
-        cov_bin_hypertension = cov_bin_hypertension,
-        cov_bin_diabetes = cov_bin_diabetes,
-        cov_bin_obesity = cov_bin_obesity,
-        cov_bin_copd = cov_bin_copd,
-        cov_bin_ami = cov_bin_ami,
-        cov_bin_stroke_isch = cov_bin_stroke_isch,
-        cov_bin_depression = cov_bin_depression,
+        **registered["core_covariates"],
         ### Project specific covariates
-        cov_bin_pneumonia = cov_bin_pneumonia,
-        cov_bin_asthma = cov_bin_asthma,
-        cov_bin_ild = cov_bin_ild,
+        **registered["project_covariates"],
         ### Subgroups
         sub_bin_covidhistory = sub_bin_covidhistory,
         sub_cat_covidhospital = sub_cat_covidhospital,
@@ -578,3 +320,51 @@ def generate_variables(index_date, end_date_exp, end_date_out):
         sub_bin_copd_ever = sub_bin_copd_ever
     ) 
     return dynamic_variables
+
+# Define generate static variables function
+# Variables that do not depend on a cohort's index dates: they are the same for every cohort, so are
+# written once to input_patients (see dataset_definition_patients.py) rather than to each input_<cohort>
+def generate_static_variables():
+
+    ## Quality assurance-----------------------------------------------------------------------------------
+
+    ### Year of birth
+    qa_num_birth_year = patients.date_of_birth.year
+
+    ## Core covariates-------------------------------------------------------------------------------------
+
+    ### Sex
+    cov_cat_sex = patients.sex
+
+    ### Consultation rate in 2019
+    tmp_cov_num_consrate2019 = appointments.where(
+        appointments.status.is_in([
+            "Arrived",
+            "In Progress",
+            "Finished",
+            "Visit",
+            "Waiting",
+            "Patient Walked Out",
+            ]) & appointments.start_date.is_on_or_between("2019-01-01", "2019-12-31")
+            ).count_for_patient()    
+
+    cov_num_consrate2019 = case(
+        when(tmp_cov_num_consrate2019 <= 365).then(tmp_cov_num_consrate2019),
+        otherwise=365,
+    )
+
+    ### Healthcare worker
+    cov_bin_hcworker = occupation_on_covid_vaccine_record.where(
+        (occupation_on_covid_vaccine_record.is_healthcare_worker == True)
+    ).exists_for_patient()
+
+    ## Define dictionary of variables to be written into dataset-------------------------------------------
+    static_variables = dict(
+        ### Quality assurance
+        qa_num_birth_year = qa_num_birth_year,
+        ### Core covariates
+        cov_cat_sex = cov_cat_sex,
+        cov_num_consrate2019 = cov_num_consrate2019,
+        cov_bin_hcworker = cov_bin_hcworker,
+    )
+    return static_variables
@@ -12,19 +12,48 @@ from ehrql.tables.tpp import (
     ons_deaths,
 )
 
-# Codelists from codelists.py (which pulls all variables from the codelist folder)
-
-from codelists import *
-
-from datetime import date
+# Codelists from codelists.py (only the codelists imported here are loaded)
+
+from codelists import (
+    bmi_primis,
+    learndis_primis,
+    longres_primis,
+    shield_primis,
+    nonshield_primis,
+    preg_primis,
+    pregdel_primis,
+    bmi_stage_primis,
+    sev_obesity_primis,
+    ast_primis,
+    astadm_primis,
+    astrx_primis,
+    resp_primis,
+    cns_primis,
+    spln_primis,
+    diab_primis,
+    dmres_primis,
+    sev_mental_primis,
+    smhres_primis,
+    chd_primis,
+    ckd_primis,
+    ckd15_primis,
+    ckd35_primis,
+    cld_primis,
+    immdx_primis,
+    immrx_primis,
+)
 
 # Call functions from variable_helper_functions
 from variable_helper_functions import (
     last_matching_event_clinical_snomed_between,
     last_matching_event_clinical_snomed_before,
     last_matching_med_dmd_between,
+    vaccination_doses,
 )
 
+# JCVI group and eligibility rules
+from jcvi_rules import jcvi_group, jcvi_eligible_date
+
 # Define the study_dates dictionary 
 
 import json
@@ -279,50 +308,24 @@ longres_group = last_matching_event_clinical_snomed_before(
     longres_primis, vax1_earliest
 ).exists_for_patient()
 
-# jcvi_group
-vax_cat_jcvi_group = case(
-    when((longres_group) & (vax_jcvi_age_1 > 65)).then("01"),
-    when(vax_jcvi_age_1 >= 80).then("02"),
-    when(vax_jcvi_age_1 >= 75).then("03"),
-    when((vax_jcvi_age_1 >= 70) | 
-         (cev_group & (vax_jcvi_age_1 >= 16) & (~preg_group))).then("04"),
-    when(vax_jcvi_age_1 >= 65).then("05"),
-    when((atrisk_group) & (vax_jcvi_age_1 >= 16)).then("06"),
-    when(vax_jcvi_age_1 >= 60).then("07"),
-    when(vax_jcvi_age_1 >= 55).then("08"),
-    when(vax_jcvi_age_1 >= 50).then("09"),
-    when(vax_jcvi_age_2 >= 40).then("10"),
-    when(vax_jcvi_age_2 >= 30).then("11"),
-    when(vax_jcvi_age_2 >= 18).then("12"),
-    otherwise="99"  # Default group if no other criteria are met
+# jcvi_group, from the rules in lib/jcvi_groups.csv (see jcvi_rules.py)
+jcvi_ages = dict(
+    vax_jcvi_age_1=vax_jcvi_age_1,
+    vax_jcvi_age_2=vax_jcvi_age_2,
 )
 
-# vaccination eligible date according to jcvi
-vax_date_eligible = case(
-    when((vax_cat_jcvi_group == "01") | (vax_cat_jcvi_group == "02")).then(date(2020, 12, 8)),
-    when((vax_cat_jcvi_group == "03") | (vax_cat_jcvi_group == "04")).then(date(2021, 1, 18)),
-    when((vax_cat_jcvi_group == "05") | (vax_cat_jcvi_group == "06")).then(date(2021, 2, 15)),
-    when((vax_cat_jcvi_group == "07") & (vax_jcvi_age_1 >= 64) & (vax_jcvi_age_1 < 65)).then(date(2021, 2, 22)),
-    when((vax_cat_jcvi_group == "07") & (vax_jcvi_age_1 >= 60) & (vax_jcvi_age_1 < 64)).then(date(2021, 3, 1)),
-    when((vax_cat_jcvi_group == "08") & (vax_jcvi_age_1 >= 56) & (vax_jcvi_age_1 < 60)).then(date(2021, 3, 8)),
-    when((vax_cat_jcvi_group == "08") & (vax_jcvi_age_1 >= 55) & (vax_jcvi_age_1 < 56)).then(date(2021, 3, 9)),
-    when((vax_cat_jcvi_group == "09") & (vax_jcvi_age_1 >= 50) & (vax_jcvi_age_1 < 55)).then(date(2021, 3, 19)),
-    when((vax_cat_jcvi_group == "10") & (vax_jcvi_age_2 >= 45) & (vax_jcvi_age_1 < 50)).then(date(2021, 4, 13)),
-    when((vax_cat_jcvi_group == "10") & (vax_jcvi_age_2 >= 44) & (vax_jcvi_age_1 < 45)).then(date(2021, 4, 26)),
-    when((vax_cat_jcvi_group == "10") & (vax_jcvi_age_2 >= 42) & (vax_jcvi_age_1 < 44)).then(date(2021, 4, 27)),
-    when((vax_cat_jcvi_group == "10") & (vax_jcvi_age_2 >= 40) & (vax_jcvi_age_1 < 42)).then(date(2021, 4, 30)),
-    when((vax_cat_jcvi_group == "11") & (vax_jcvi_age_2 >= 38) & (vax_jcvi_age_2 < 40)).then(date(2021, 5, 13)),
-    when((vax_cat_jcvi_group == "11") & (vax_jcvi_age_2 >= 36) & (vax_jcvi_age_2 < 38)).then(date(2021, 5, 19)),
-    when((vax_cat_jcvi_group == "11") & (vax_jcvi_age_2 >= 34) & (vax_jcvi_age_2 < 36)).then(date(2021, 5, 21)),
-    when((vax_cat_jcvi_group == "11") & (vax_jcvi_age_2 >= 32) & (vax_jcvi_age_2 < 34)).then(date(2021, 5, 25)),
-    when((vax_cat_jcvi_group == "11") & (vax_jcvi_age_2 >= 30) & (vax_jcvi_age_2 < 32)).then(date(2021, 5, 26)),
-    when((vax_cat_jcvi_group == "12") & (vax_jcvi_age_2 >= 25) & (vax_jcvi_age_2 < 30)).then(date(2021, 6, 8)),
-    when((vax_cat_jcvi_group == "12") & (vax_jcvi_age_2 >= 23) & (vax_jcvi_age_2 < 25)).then(date(2021, 6, 15)),
-    when((vax_cat_jcvi_group == "12") & (vax_jcvi_age_2 >= 21) & (vax_jcvi_age_2 < 23)).then(date(2021, 6, 16)),
-    when((vax_cat_jcvi_group == "12") & (vax_jcvi_age_2 >= 18) & (vax_jcvi_age_2 < 21)).then(date(2021, 6, 18)),
-    otherwise=date(2021, 6, 18)  # Default if no other criteria are met
+vax_cat_jcvi_group = jcvi_group(
+    jcvi_ages,
+    dict(
+        longres_group=longres_group,
+        cev_not_pregnant=cev_group & (~preg_group),
+        atrisk_group=atrisk_group,
+    ),
 )
 
+# vaccination eligible date according to jcvi, from the rules in lib/jcvi_eligibility.csv
+vax_date_eligible = jcvi_eligible_date(vax_cat_jcvi_group, jcvi_ages)
+
 # Define a dictionary of JCVI variables created above 
 jcvi_variables = dict(
     vax_jcvi_age_1=vax_jcvi_age_1,  # Age on phase 1 reference date
@@ -365,162 +368,40 @@ death_date = minimum_of(primary_care_death_date, ons_died_from_any_cause_date)
 
 # add vaccination dates----------------------------------------------------------------------------
 
-# COVID-19 Vaccination (identified by target diseases of the vaccination)
-
-vax_date_covid_1 = (
-    vaccinations.where(
-    vaccinations.target_disease.contains("SARS-2 CORONAVIRUS"))
-    .where(vaccinations.date.is_on_or_after(vax1_earliest))
-    .sort_by(vaccinations.date)
-    .first_for_patient()
-    .date
-)
-
-vax_date_covid_2 = (
-    vaccinations.where(
-    vaccinations.target_disease.contains("SARS-2 CORONAVIRUS"))
-    .where(vaccinations.date > vax_date_covid_1)  # Exclude the first date
-    .sort_by(vaccinations.date)
-    .first_for_patient()
-    .date  # Now this will be the second date
-)
-
-vax_date_covid_3 = (
-    vaccinations.where(
-    vaccinations.target_disease.contains("SARS-2 CORONAVIRUS"))
-    .where(vaccinations.date > vax_date_covid_2)  # Exclude the first and second date
-    .sort_by(vaccinations.date)
-    .first_for_patient()
-    .date  # Now this will be the third date
-)
-
-vax_num_covid = (
-    vaccinations.where(
-    vaccinations.target_disease.contains("SARS-2 CORONAVIRUS"))
-    .sort_by(vaccinations.date)
-    .count_for_patient()
-)
-
-# Pfizer BioNTech Vaccination (identified by vaccination_id.product_name: 28.COVID-19 mRNA Vaccine Comirnaty 30micrograms/0.3ml dose conc for susp for inj MDV (Pfizer))
-vax_date_Pfizer_1 = (
-    vaccinations.where(
-    (vaccinations.product_name == "COVID-19 mRNA Vaccine Comirnaty 30micrograms/0.3ml dose conc for susp for inj MDV (Pfizer)"))
-    .where(vaccinations.date.is_on_or_after(vax1_earliest))
-    .sort_by(vaccinations.date)
-    .first_for_patient()
-    .date
-)
-
-vax_date_Pfizer_2 = (
-    vaccinations.where(
-    (vaccinations.product_name == "COVID-19 mRNA Vaccine Comirnaty 30micrograms/0.3ml dose conc for susp for inj MDV (Pfizer)"))
-    .where(vaccinations.date > vax_date_Pfizer_1)  # Exclude the first date
-    .sort_by(vaccinations.date)
-    .first_for_patient()
-    .date  # Now this will be the second date
-)
-
-vax_date_Pfizer_3 = (
-    vaccinations.where(
-    (vaccinations.product_name == "COVID-19 mRNA Vaccine Comirnaty 30micrograms/0.3ml dose conc for susp for inj MDV (Pfizer)"))
-    .where(vaccinations.date > vax_date_Pfizer_2)  # Exclude the first and second date
-    .sort_by(vaccinations.date)
-    .first_for_patient()
-    .date  # Now this will be the third date
-)
-
-vax_num_Pfizer = (
-    vaccinations.where(
-    (vaccinations.product_name == "COVID-19 mRNA Vaccine Comirnaty 30micrograms/0.3ml dose conc for susp for inj MDV (Pfizer)"))
-    .sort_by(vaccinations.date)
-    .count_for_patient()
+# COVID-19 vaccine products (vaccination_id.product_name), keyed by the name used in variable names
+# Pfizer BioNTech: 28.COVID-19 mRNA Vaccine Comirnaty 30micrograms/0.3ml dose conc for susp for inj MDV (Pfizer)
+# Oxford AZ: 49.COVID-19 Vaccine Vaxzevria 0.5ml inj multidose vials (AstraZeneca)
+# Moderna: 30.COVID-19 mRNA Vaccine Spikevax (nucleoside modified) 0.1mg/0.5mL dose disp for inj MDV (Moderna)
+# Further product names (e.g. booster formulations) can be added to a product's list
+covid_vaccine_products = dict(
+    Pfizer=["COVID-19 mRNA Vaccine Comirnaty 30micrograms/0.3ml dose conc for susp for inj MDV (Pfizer)"],
+    AstraZeneca=["COVID-19 Vaccine Vaxzevria 0.5ml inj multidose vials (AstraZeneca)"],
+    Moderna=["COVID-19 mRNA Vaccine Spikevax (nucleoside modified) 0.1mg/0.5mL dose disp for inj MDV (Moderna)"],
 )
 
-# Oxford AZ Vaccination (identified by vaccination_id.product_name: 49.COVID-19 Vaccine Vaxzevria 0.5ml inj multidose vials (AstraZeneca))
+# Number of doses to extract for each group (increase for boosters)
+vax_doses = 3
 
-vax_date_AstraZeneca_1 = (
-    vaccinations.where(
-    (vaccinations.product_name == "COVID-19 Vaccine Vaxzevria 0.5ml inj multidose vials (AstraZeneca)"))
-    .where(vaccinations.date.is_on_or_after(vax1_earliest))
-    .sort_by(vaccinations.date)
-    .first_for_patient()
-    .date
+# COVID-19 Vaccination (identified by target diseases of the vaccination) and vaccination by product
+vax_groups = dict(
+    covid=vaccinations.target_disease.contains("SARS-2 CORONAVIRUS"),
+    **{
+        product: vaccinations.product_name.is_in(product_names)
+        for product, product_names in covid_vaccine_products.items()
+    },
 )
 
-vax_date_AstraZeneca_2 = (
-    vaccinations.where(
-    (vaccinations.product_name == "COVID-19 Vaccine Vaxzevria 0.5ml inj multidose vials (AstraZeneca)"))
-    .where(vaccinations.date > vax_date_AstraZeneca_1)  # Exclude the first date
-    .sort_by(vaccinations.date)
-    .first_for_patient()
-    .date  # Now this will be the second date
-)
+# Dose dates (vax_date_<group>_<dose>)
+vax_dose_variables = vaccination_doses(vax_groups, vax1_earliest, doses=vax_doses)
 
-vax_date_AstraZeneca_3 = (
-    vaccinations.where(
-    (vaccinations.product_name == "COVID-19 Vaccine Vaxzevria 0.5ml inj multidose vials (AstraZeneca)"))
-    .where(vaccinations.date > vax_date_AstraZeneca_2)  # Exclude the first and second date
-    .sort_by(vaccinations.date)
-    .first_for_patient()
-    .date  # Now this will be the third date
-)
-
-vax_num_AstraZeneca = (
-    vaccinations.where(
-    (vaccinations.product_name == "COVID-19 Vaccine Vaxzevria 0.5ml inj multidose vials (AstraZeneca)"))
-    .sort_by(vaccinations.date)
-    .count_for_patient()
-)
-
-# Moderna Vaccination (identified by vaccination_id.product_name: 30.COVID-19 mRNA Vaccine Spikevax (nucleoside modified) 0.1mg/0.5mL dose disp for inj MDV (Moderna))
-
-vax_date_Moderna_1 = (
-    vaccinations.where(
-    (vaccinations.product_name == "COVID-19 mRNA Vaccine Spikevax (nucleoside modified) 0.1mg/0.5mL dose disp for inj MDV (Moderna)"))
-    .where(vaccinations.date.is_on_or_after(vax1_earliest))
-    .sort_by(vaccinations.date)
-    .first_for_patient()
-    .date
-)
-
-vax_date_Moderna_2 = (
-    vaccinations.where(
-    (vaccinations.product_name == "COVID-19 mRNA Vaccine Spikevax (nucleoside modified) 0.1mg/0.5mL dose disp for inj MDV (Moderna)"))
-    .where(vaccinations.date > vax_date_Moderna_1)  # Exclude the first date
-    .sort_by(vaccinations.date)
-    .first_for_patient()
-    .date  # Now this will be the second date
-)
-
-vax_date_Moderna_3 = (
-    vaccinations.where(
-    (vaccinations.product_name == "COVID-19 mRNA Vaccine Spikevax (nucleoside modified) 0.1mg/0.5mL dose disp for inj MDV (Moderna)"))
-    .where(vaccinations.date > vax_date_Moderna_2)  # Exclude the first and second date
-    .sort_by(vaccinations.date)
-    .first_for_patient()
-    .date  # Now this will be the third date
-)
-
-vax_num_Moderna = (
-    vaccinations.where(
-    (vaccinations.product_name == "COVID-19 mRNA Vaccine Spikevax (nucleoside modified) 0.1mg/0.5mL dose disp for inj MDV (Moderna)"))
-    .sort_by(vaccinations.date)
-    .count_for_patient()
-)
+vax_date_variables = {
+    f"vax_date_{group}_{dose}": vax_dose_variables[f"{group}_{dose}"]
+    for group in vax_groups
+    for dose in range(1, vax_doses + 1)
+}
 
 # Define a dictionary of preliminary date variables (Death, Vaccination) created above 
 prelim_date_variables = dict(
     cens_date_death=death_date,
-    vax_date_covid_1=vax_date_covid_1,
-    vax_date_covid_2=vax_date_covid_2,
-    vax_date_covid_3=vax_date_covid_3,
-    vax_date_Pfizer_1=vax_date_Pfizer_1,
-    vax_date_Pfizer_2=vax_date_Pfizer_2,
-    vax_date_Pfizer_3=vax_date_Pfizer_3,
-    vax_date_AstraZeneca_1=vax_date_AstraZeneca_1,
-    vax_date_AstraZeneca_2=vax_date_AstraZeneca_2,
-    vax_date_AstraZeneca_3=vax_date_AstraZeneca_3,
-    vax_date_Moderna_1=vax_date_Moderna_1,
-    vax_date_Moderna_2=vax_date_Moderna_2,
-    vax_date_Moderna_3=vax_date_Moderna_3,
-)
\ No newline at end of file
+    **vax_date_variables,
+)
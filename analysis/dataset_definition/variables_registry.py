@@ -0,0 +1,124 @@
+# Compile the outcomes and covariates declared in variables_registry.json
+#
+# Each entry names the codelists (from codelists.py) to match in each source:
+#   gp       clinical_events, SNOMED CT codes
+#   gp_ctv3  clinical_events, CTV3 codes
+#   med      medications, dm+d codes
+#   apc      apcs, ICD-10 codes in any diagnosis
+#   death    ons_deaths, ICD-10 codes in any cause of death
+# Outcomes give tmp_out_date_<outcome>_<gp|med|apc|death> (the first date in each source between the
+# index date and the end of outcome follow-up; gp is the earlier of gp and gp_ctv3) and
+# out_date_<outcome>, the earliest of these.
+# Covariates give cov_bin_<covariate>, true if a code was recorded in any source before the index date.
+#
+# registry_features groups the entries by source, and match_features compiles each source's entries
+# with the multi-feature helpers in variable_helper_functions.py, giving one query per entry and
+# source. Further features, such as quality assurance or subgroup variables, can be added to the
+# same sources before they are matched.
+
+import json
+from functools import partial
+
+from ehrql import case, when, minimum_of
+from ehrql.tables.tpp import ons_deaths
+
+import codelists
+from variable_helper_functions import (
+    any_of,
+    matching_events_clinical_batch,
+    matching_events_med_batch,
+    matching_events_apc_batch,
+    matching_deaths_batch,
+)
+
+registry_path = "analysis/dataset_definition/variables_registry.json"
+
+sources = ["gp", "gp_ctv3", "med", "apc", "death"]
+
+covariate_sections = ["core_covariates", "project_covariates"]
+
+def load_registry(path=registry_path):
+    with open(path) as f:
+        registry = json.load(f)
+    for section, entries in registry.items():
+        for name, entry in entries.items():
+            unknown = set(entry) - set(sources)
+            if unknown:
+                raise ValueError(f"Unknown sources for {section}.{name}: {', '.join(sorted(unknown))}")
+    return registry
+
+# Concatenate the codelists named by an entry
+def entry_codelist(codelist_names):
+    codes = []
+    for codelist_name in codelist_names:
+        codes += getattr(codelists, codelist_name)
+    return codes
+
+def feature_spec(source, codelist, window, kind):
+    # death features are booleans, so have no kind
+    return (codelist, window) if source == "death" else (codelist, window, kind)
+
+# Features to compute for the registry, as a dict of source -> dict of feature name -> feature spec
+
+def registry_features(registry, index_date, end_date_out):
+    features = {source: {} for source in sources}
+    for name, entry in registry["outcomes"].items():
+        for source, codelist_names in entry.items():
+            features[source][f"out_{name}"] = feature_spec(
+                source, entry_codelist(codelist_names), ("between", index_date, end_date_out), "first"
+            )
+    for section in covariate_sections:
+        for name, entry in registry[section].items():
+            for source, codelist_names in entry.items():
+                features[source][f"cov_bin_{name}"] = feature_spec(
+                    source, entry_codelist(codelist_names), ("before", index_date), "exists"
+                )
+    return features
+
+# Compute the features of each source with its multi-feature helper
+
+def match_features(features):
+    batches = dict(
+        gp=matching_events_clinical_batch,
+        gp_ctv3=partial(matching_events_clinical_batch, code_column="ctv3_code"),
+        med=matching_events_med_batch,
+        apc=matching_events_apc_batch,
+        death=matching_deaths_batch,
+    )
+    return {
+        source: batches[source](source_features) if source_features else {}
+        for source, source_features in features.items()
+    }
+
+# Variables for each section of the registry, from the matched features
+
+def outcome_date(source, matched):
+    if source in ("gp", "gp_ctv3", "med"):
+        return matched.date
+    if source == "apc":
+        return matched.admission_date
+    if source == "death":
+        return case(when(matched).then(ons_deaths.date))
+    raise ValueError(f"Unknown source: {source}")
+
+# Earliest of several dates, or the date itself
+def earliest(dates):
+    return minimum_of(*dates) if len(dates) > 1 else dates[0]
+
+def registry_variables(registry, matched):
+    variables = {"outcomes": {}}
+    for name, entry in registry["outcomes"].items():
+        # gp and gp_ctv3 are both primary care, so an outcome with both has one gp date, the earlier
+        dates = {}
+        for source in entry:
+            label = "gp" if source.startswith("gp") else source
+            dates.setdefault(label, []).append(outcome_date(source, matched[source][f"out_{name}"]))
+        dates = {f"tmp_out_date_{name}_{label}": earliest(label_dates) for label, label_dates in dates.items()}
+        variables["outcomes"].update(dates)
+        variables["outcomes"][f"out_date_{name}"] = earliest(list(dates.values()))
+    for section in covariate_sections:
+        variables[section] = {
+            f"cov_bin_{name}": any_of([matched[source][f"cov_bin_{name}"] for source in entry])
+            for name, entry in registry[section].items()
+        }
+    return variables
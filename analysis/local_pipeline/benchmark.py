@@ -0,0 +1,192 @@
+# Benchmark the dataset definitions against synthetic data at several population scales
+#
+# Usage (from the repository root, with ehrQL, numpy and pyarrow installed):
+#   python analysis/local_pipeline/benchmark.py [--scales 10000 100000 1000000]
+#       [--actions generate_dates generate_input_prevax ...] [--per-variable]
+#       [--threshold 0.2] [--update-baseline]
+#
+# For each scale, synthetic Arrow tables are generated with synthetic_data.py (if not already
+# present) and each action's dataset definition is run with ehrQL's local file engine
+# (`ehrql generate-dataset --dummy-tables`). Every run records its wall time, peak RSS and
+# output size. With --per-variable, every variable of prelim_date_variables, jcvi_variables
+# and the cohorts' dynamic_variables is also run on its own (see benchmark_variable.py).
+#
+# Results are written to output/local_pipeline/benchmark/results.json and compared with
+# output/local_pipeline/benchmark/baseline.json: a run whose wall time or peak RSS exceeds
+# the baseline by more than --threshold is reported as a regression, and the script exits
+# with status 1. Use --update-baseline to store the results as the new baseline.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic_data  # noqa: E402
+
+benchmark_dir = "output/local_pipeline/benchmark"
+results_path = f"{benchmark_dir}/results.json"
+baseline_path = f"{benchmark_dir}/baseline.json"
+
+# Actions as in project.yaml: dataset definition and output (relative to the working directory)
+actions = {
+    "generate_dates": (
+        "analysis/dataset_definition/dataset_definition_dates.py",
+        "output/dataset_definition/index_dates.arrow",
+    ),
+    **{
+        f"generate_input_{cohort}": (
+            f"analysis/dataset_definition/dataset_definition_{cohort}.py",
+            f"output/dataset_definition/input_{cohort}.csv.gz",
+        )
+        for cohort in ["patients", "prevax", "vax", "unvax"]
+    },
+}
+
+variable_groups = ["prelim", "jcvi", "patients", "prevax", "vax", "unvax"]
+
+# Paths read by the dataset definitions, linked into each scale's working directory
+linked_paths = ["analysis", "codelists", "lib"]
+
+# Running ehrQL -----------------------------------------------------------------------------------
+
+# Run a command, returning its wall time (seconds) and peak resident set size (MB)
+def measure(command, cwd):
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=stderr)
+        # wait4 reports the resource use of the child (and of any children it waited for)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"{' '.join(command)} failed:\n{stderr.read().decode()}")
+    return dict(wall_seconds=round(wall, 3), peak_rss_mb=round(usage.ru_maxrss / 1024, 1))
+
+def generate_dataset(definition, output, dummy_tables, cwd, arguments=()):
+    os.makedirs(os.path.join(cwd, os.path.dirname(output)), exist_ok=True)
+    command = [
+        "ehrql", "generate-dataset", definition,
+        "--output", output,
+        "--dummy-tables", dummy_tables,
+    ]
+    if arguments:
+        command += ["--", *arguments]
+    result = measure(command, cwd)
+    result["output_mb"] = round(os.path.getsize(os.path.join(cwd, output)) / 1024**2, 3)
+    return result
+
+# Set up a working directory for one scale, so that its outputs (e.g. index_dates.arrow)
+# do not overwrite those of the pipeline or of other scales
+def scale_directory(scale):
+    return working_directory(f"{benchmark_dir}/{scale}")
+
+def working_directory(directory):
+    cwd = os.path.abspath(directory)
+    os.makedirs(cwd, exist_ok=True)
+    for path in linked_paths:
+        link = os.path.join(cwd, path)
+        if not os.path.lexists(link):
+            os.symlink(os.path.abspath(path), link)
+    return cwd
+
+def synthetic_tables(scale):
+    output_dir = os.path.abspath(f"output/local_pipeline/synthetic/{scale}_arrow")
+    if not os.path.exists(os.path.join(output_dir, "patients.arrow")):
+        print(f"Generating synthetic data for {scale} patients")
+        synthetic_data.generate(scale, output_dir, file_format="arrow")
+    return output_dir
+
+def variable_names(group):
+    output = subprocess.run(
+        [sys.executable, "analysis/local_pipeline/benchmark_variable.py", "--group", group, "--list"],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+# Benchmark -------------------------------------------------------------------------------------
+
+def benchmark(scales, action_names, per_variable=False):
+    results = {}
+    for scale in scales:
+        dummy_tables = synthetic_tables(scale)
+        cwd = scale_directory(scale)
+        scale_results = results[str(scale)] = dict(actions={}, variables={})
+
+        for name in action_names:
+            definition, output = actions[name]
+            scale_results["actions"][name] = generate_dataset(definition, output, dummy_tables, cwd)
+            print(f"{scale:>9} {name:<40} {format_result(scale_results['actions'][name])}")
+
+        if per_variable:
+            for group in variable_groups:
+                for variable in variable_names(group):
+                    key = f"{group}.{variable}"
+                    result = generate_dataset(
+                        "analysis/local_pipeline/benchmark_variable.py",
+                        f"output/local_pipeline/variables/{group}/{variable}.arrow",
+                        dummy_tables,
+                        cwd,
+                        ["--group", group, "--variable", variable],
+                    )
+                    scale_results["variables"][key] = result
+                    print(f"{scale:>9} {key:<40} {format_result(result)}")
+    return results
+
+def format_result(result):
+    return f"{result['wall_seconds']:>9.2f}s {result['peak_rss_mb']:>9.1f}MB {result['output_mb']:>9.2f}MB"
+
+# Runs whose wall time or peak RSS grew by more than threshold (a fraction) since the baseline
+def regressions(results, baseline, threshold):
+    found = []
+    for scale, scale_results in results.items():
+        for kind, runs in scale_results.items():
+            for name, result in runs.items():
+                previous = baseline.get(scale, {}).get(kind, {}).get(name)
+                if previous is None:
+                    continue
+                for metric in ["wall_seconds", "peak_rss_mb"]:
+                    if previous[metric] > 0 and result[metric] > previous[metric] * (1 + threshold):
+                        found.append(dict(
+                            scale=scale, name=name, metric=metric,
+                            baseline=previous[metric], result=result[metric],
+                        ))
+    return found
+
+def read_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def write_json(path, obj):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(obj, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the dataset definitions")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--actions", nargs="+", choices=list(actions), default=list(actions))
+    parser.add_argument("--per-variable", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    results = benchmark(args.scales, args.actions, args.per_variable)
+    write_json(results_path, results)
+
+    if args.update_baseline:
+        # Keep the baseline of scales that were not run this time
+        write_json(baseline_path, {**read_json(baseline_path), **results})
+        print(f"Updated {baseline_path}")
+        sys.exit()
+
+    found = regressions(results, read_json(baseline_path), args.threshold)
+    for r in found:
+        print(f"Regression at {r['scale']} patients: {r['name']} {r['metric']} {r['baseline']} -> {r['result']}")
+    sys.exit(1 if found else 0)
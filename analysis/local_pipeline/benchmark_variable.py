@@ -0,0 +1,55 @@
+# Dataset definition holding a single variable, used by benchmark.py for the per-variable breakdown
+#
+# Usage:
+#   ehrql generate-dataset analysis/local_pipeline/benchmark_variable.py --output <file>
+#       --dummy-tables <dir> -- --group prelim|jcvi|patients|<cohort> --variable <name>
+#   python analysis/local_pipeline/benchmark_variable.py --group <group> --list
+#
+# prelim and jcvi are the prelim_date_variables and jcvi_variables dictionaries of
+# variables_dates.py, and patients the static variables of generate_static_variables; a cohort
+# name (prevax, vax or unvax) selects the dynamic_variables returned by generate_variables for
+# that cohort's index dates.
+
+import argparse
+import json
+import os
+import sys
+
+from ehrql import create_dataset
+from ehrql.tables.tpp import patients
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dataset_definition"))
+
+def variable_groups(group):
+    if group == "prelim":
+        from variables_dates import prelim_date_variables
+        return prelim_date_variables
+    if group == "jcvi":
+        from variables_dates import jcvi_variables
+        return jcvi_variables
+    if group == "patients":
+        from variables_cohorts import generate_static_variables
+        return generate_static_variables()
+    cohort = __import__(f"dataset_definition_{group}")
+    from variables_cohorts import generate_variables
+    return generate_variables(
+        cohort.index_date, cohort.end_date_exposure, cohort.end_date_outcome, **cohort.intermediates
+    )
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--group", required=True)
+parser.add_argument("--variable")
+parser.add_argument("--list", action="store_true", help="print the names of the variables in the group")
+args = parser.parse_args()
+
+if args.list:
+    print(json.dumps(list(variable_groups(args.group))))
+    sys.exit()
+
+dataset = create_dataset()
+
+dataset.define_population(
+    patients.date_of_birth.is_not_null()
+)
+
+setattr(dataset, args.variable, variable_groups(args.group)[args.variable])
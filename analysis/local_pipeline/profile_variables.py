@@ -0,0 +1,117 @@
+# Per-variable cost profile of the dataset definitions
+#
+# Usage (from the repository root, with ehrQL and pyarrow installed):
+#   python analysis/local_pipeline/profile_variables.py [--scale 100000] [--top 20]
+#       [<dataset definition> ...]
+#
+# Each dataset definition is loaded in its own process with profiling enabled (see
+# analysis/dataset_definition/profiling.py), recording the query graph of every variable.
+# This is combined with the benchmark of the same scale (benchmark.py --per-variable), if it
+# has been run, to give for each variable:
+#   - evaluation time and peak RSS of extracting the variable on its own
+#   - rows scanned per source table (the size of each table it reads in the synthetic data)
+#   - result size (the number of patients with a non-null value)
+# The profile is written to output/local_pipeline/profile.json, sorted by cost: evaluation
+# time when it was measured, otherwise the number of rows scanned.
+
+import argparse
+import json
+import os
+import runpy
+import subprocess
+import sys
+
+import pyarrow.feather as feather
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import benchmark  # noqa: E402
+import synthetic_data  # noqa: E402
+
+definitions = [
+    "analysis/dataset_definition/dataset_definition_dates.py",
+    "analysis/dataset_definition/dataset_definition_patients.py",
+    "analysis/dataset_definition/dataset_definition_prevax.py",
+    "analysis/dataset_definition/dataset_definition_vax.py",
+    "analysis/dataset_definition/dataset_definition_unvax.py",
+]
+
+output_path = "output/local_pipeline/profile.json"
+
+# Load a dataset definition with profiling enabled and return its variable profiles
+
+def profile_definition(definition):
+    sys.path.insert(0, os.path.dirname(definition))
+    import profiling
+    profiling.enabled = True
+    runpy.run_path(definition)
+    # generate_dataset does not know which cohort it is extracting: name the group after the definition
+    cohort = os.path.basename(definition).removeprefix("dataset_definition_").removesuffix(".py")
+    for profile in profiling.variable_profiles:
+        if profile["group"] == "cohort":
+            profile["group"] = cohort
+    return profiling.variable_profiles
+
+def graph_profiles(definitions):
+    profiles = []
+    for definition in definitions:
+        result = subprocess.run(
+            [sys.executable, __file__, "--definition", definition],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        profiles += json.loads(result.stdout.splitlines()[-1])
+    return profiles
+
+# Number of patients with a value in a variable's output from the per-variable benchmark
+
+def result_size(scale, group, name):
+    path = f"{benchmark.benchmark_dir}/{scale}/output/local_pipeline/variables/{group}/{name}.arrow"
+    if not os.path.exists(path):
+        return None
+    column = feather.read_table(path, columns=[name], memory_map=True).column(name)
+    return len(column) - column.null_count
+
+def variable_profile(definitions, scale):
+    synthetic_dir = f"output/local_pipeline/synthetic/{scale}_arrow"
+    table_rows = synthetic_data.table_sizes(synthetic_dir) if os.path.exists(synthetic_dir) else {}
+    timings = benchmark.read_json(benchmark.results_path).get(str(scale), {}).get("variables", {})
+
+    profiles = graph_profiles(definitions)
+    for profile in profiles:
+        profile["rows_scanned"] = {table: table_rows.get(table) for table in profile["tables"]}
+        timing = timings.get(f"{profile['group']}.{profile['name']}", {})
+        profile["wall_seconds"] = timing.get("wall_seconds")
+        profile["peak_rss_mb"] = timing.get("peak_rss_mb")
+        profile["result_rows"] = result_size(scale, profile["group"], profile["name"])
+    return sorted(profiles, key=cost, reverse=True)
+
+def cost(profile):
+    if profile["wall_seconds"] is not None:
+        return (1, profile["wall_seconds"])
+    return (0, sum(rows or 0 for rows in profile["rows_scanned"].values()))
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["--definition"]:
+        print(json.dumps(profile_definition(args[1])))
+        sys.exit()
+
+    parser = argparse.ArgumentParser(description="Profile the cost of each variable")
+    parser.add_argument("--scale", type=int, default=100_000)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("definitions", nargs="*", default=definitions)
+    args = parser.parse_args()
+
+    profiles = variable_profile(args.definitions, args.scale)
+    benchmark.write_json(output_path, dict(scale=args.scale, variables=profiles))
+
+    print(f"{'variable':<50} {'seconds':>9} {'rows scanned':>14} {'result rows':>12} {'nodes':>7} {'codes':>7}")
+    for profile in profiles[:args.top]:
+        seconds = "" if profile["wall_seconds"] is None else f"{profile['wall_seconds']:.2f}"
+        rows = sum(rows or 0 for rows in profile["rows_scanned"].values())
+        result_rows = "" if profile["result_rows"] is None else profile["result_rows"]
+        print(
+            f"{profile['group'] + '.' + profile['name']:<50} {seconds:>9} {rows:>14} "
+            f"{result_rows:>12} {profile['nodes']:>7} {profile['codes']:>7}"
+        )
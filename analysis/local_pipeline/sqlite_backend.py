@@ -0,0 +1,191 @@
+# Local SQLite stand-in for the TPP backend
+#
+# Usage (from the repository root, with ehrQL, numpy and pyarrow installed):
+#   python analysis/local_pipeline/sqlite_backend.py load [--patients 100000] [--source DIR]
+#       [--index TABLE=COLUMN,COLUMN ...] [--no-default-indexes]
+#   python analysis/local_pipeline/sqlite_backend.py run [--patients 100000]
+#       [--actions generate_dates generate_input_prevax ...]
+#
+# load copies the TPP tables used by the dataset definitions from Parquet or Arrow files (by
+# default the synthetic tables of synthetic_data.py, generated if not already present) into an
+# SQLite database, output/local_pipeline/sqlite/<patients>.db, with one table per ehrQL table.
+# Each table is indexed on (patient_id, <date column>, <code column>) as listed in table_indexes;
+# --index replaces the index of a table (repeat it for several tables, or list several indexes
+# for one table separated by ";"), so that index choices can be compared.
+#
+# run extracts the actions of benchmark.py, unchanged, with ehrQL's SQLite query engine
+# (`ehrql generate-dataset --query-engine sqlite --dsn <database>`) in a working directory under
+# output/local_pipeline/sqlite/<patients>/, recording wall time and peak RSS as benchmark.py does.
+# The SQL of a definition can be dumped with `ehrql dump-dataset-sql --query-engine sqlite` and
+# its query plans read with EXPLAIN QUERY PLAN in the sqlite3 shell.
+#
+# ehrQL has no DuckDB query engine, so DuckDB can only be used to inspect the loaded tables
+# (e.g. with its sqlite extension), not to run the dataset definitions.
+
+import argparse
+import itertools
+import os
+import sqlite3
+import sys
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import benchmark  # noqa: E402
+import synthetic_data  # noqa: E402
+
+sqlite_dir = "output/local_pipeline/sqlite"
+
+# Default index of each table: patient_id, then the date and code columns the helpers filter on
+table_indexes = dict(
+    patients=[["patient_id"]],
+    practice_registrations=[["patient_id", "start_date", "end_date"]],
+    addresses=[["patient_id", "start_date", "end_date"]],
+    clinical_events=[["patient_id", "date", "snomedct_code"], ["patient_id", "date", "ctv3_code"]],
+    medications=[["patient_id", "date", "dmd_code"]],
+    apcs=[["patient_id", "admission_date", "primary_diagnosis"]],
+    vaccinations=[["patient_id", "date", "target_disease"]],
+    ons_deaths=[["patient_id", "date"]],
+    sgss_covid_all_tests=[["patient_id", "specimen_taken_date"]],
+    emergency_care_attendances=[["patient_id", "arrival_date"]],
+    appointments=[["patient_id", "start_date", "status"]],
+    ethnicity_from_sus=[["patient_id"]],
+    occupation_on_covid_vaccine_record=[["patient_id"]],
+)
+
+def database_path(patients):
+    return f"{sqlite_dir}/{patients}.db"
+
+# Loading ---------------------------------------------------------------------------------------
+
+# SQLite column type of an Arrow type
+def sqlite_type(arrow_type):
+    if pa.types.is_integer(arrow_type) or pa.types.is_boolean(arrow_type):
+        return "INTEGER"
+    if pa.types.is_floating(arrow_type):
+        return "REAL"
+    return "TEXT"
+
+# Values as ehrQL's SQLite engine stores them: dates as ISO strings and booleans as 0/1
+def sqlite_column(column):
+    if pa.types.is_date(column.type):
+        return pc.strftime(column, format="%Y-%m-%d")
+    if pa.types.is_boolean(column.type):
+        return pc.cast(column, pa.int8())
+    return column
+
+def record_batches(path):
+    if path.endswith(".parquet"):
+        yield from pq.ParquetFile(path).iter_batches()
+    else:
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i)
+
+def table_files(source_dir):
+    files = {}
+    for filename in sorted(os.listdir(source_dir)):
+        name, ext = os.path.splitext(filename)
+        if ext in (".parquet", ".arrow") and name in table_indexes:
+            files[name] = os.path.join(source_dir, filename)
+    return files
+
+def load_table(connection, name, path):
+    batches = record_batches(path)
+    first = next(batches, None)
+    if first is None:
+        return 0
+    columns = ", ".join(f"{field.name} {sqlite_type(field.type)}" for field in first.schema)
+    placeholders = ", ".join("?" for field in first.schema)
+    connection.execute(f"DROP TABLE IF EXISTS {name}")
+    connection.execute(f"CREATE TABLE {name} ({columns})")
+    rows = 0
+    for batch in itertools.chain([first], batches):
+        values = [sqlite_column(column).to_pylist() for column in batch.columns]
+        connection.executemany(f"INSERT INTO {name} VALUES ({placeholders})", zip(*values))
+        rows += batch.num_rows
+    return rows
+
+def create_indexes(connection, name, indexes):
+    for i, columns in enumerate(indexes):
+        connection.execute(f"CREATE INDEX {name}_{i} ON {name} ({', '.join(columns)})")
+
+def load(source_dir, path, indexes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    try:
+        # The database is rebuilt from the source files, so it does not need to survive a crash
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        for name, table_path in table_files(source_dir).items():
+            rows = load_table(connection, name, table_path)
+            create_indexes(connection, name, indexes.get(name, []))
+            connection.commit()
+            print(f"{name:<40} {rows:>12} rows, indexes: {indexes.get(name, [])}")
+        # Statistics for the query planner
+        connection.execute("ANALYZE")
+        connection.commit()
+    finally:
+        connection.close()
+
+# Indexes from the defaults and --index TABLE=COLUMN,COLUMN[;COLUMN,...] options
+def parse_indexes(options, default=True):
+    indexes = dict(table_indexes) if default else {}
+    for option in options:
+        name, _, spec = option.partition("=")
+        if name not in table_indexes:
+            raise ValueError(f"Unknown table: {name}")
+        indexes[name] = [columns.split(",") for columns in spec.split(";") if columns]
+    return indexes
+
+# Running the dataset definitions -----------------------------------------------------------------
+
+def generate_dataset(definition, output, database, cwd):
+    os.makedirs(os.path.join(cwd, os.path.dirname(output)), exist_ok=True)
+    command = [
+        "ehrql", "generate-dataset", definition,
+        "--output", output,
+        "--query-engine", "sqlite",
+        "--dsn", os.path.abspath(database),
+    ]
+    result = benchmark.measure(command, cwd)
+    result["output_mb"] = round(os.path.getsize(os.path.join(cwd, output)) / 1024**2, 3)
+    return result
+
+def run(patients, action_names):
+    database = database_path(patients)
+    if not os.path.exists(database):
+        raise FileNotFoundError(f"Run `sqlite_backend.py load --patients {patients}` first")
+    cwd = benchmark.working_directory(f"{sqlite_dir}/{patients}")
+    for name in action_names:
+        definition, output = benchmark.actions[name]
+        result = generate_dataset(definition, output, database, cwd)
+        print(f"{patients:>9} {name:<40} {benchmark.format_result(result)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local SQLite stand-in for the TPP backend")
+    parser.add_argument("command", choices=["load", "run"])
+    parser.add_argument("--patients", type=int, default=100_000)
+    parser.add_argument("--source", help="directory of Parquet or Arrow tables (default: synthetic data)")
+    parser.add_argument("--index", action="append", default=[], metavar="TABLE=COLUMN,COLUMN")
+    parser.add_argument("--no-default-indexes", action="store_true")
+    parser.add_argument(
+        "--actions", nargs="+", choices=list(benchmark.actions), default=list(benchmark.actions)
+    )
+    args = parser.parse_args()
+
+    if args.command == "load":
+        source_dir = args.source
+        if source_dir is None:
+            source_dir = f"output/local_pipeline/synthetic/{args.patients}"
+            if not os.path.exists(os.path.join(source_dir, "patients.parquet")):
+                print(f"Generating synthetic data for {args.patients} patients")
+                synthetic_data.generate(args.patients, source_dir)
+        load(source_dir, database_path(args.patients), parse_indexes(args.index, not args.no_default_indexes))
+    else:
+        run(args.patients, args.actions)
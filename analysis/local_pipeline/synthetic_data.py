@@ -0,0 +1,344 @@
+# Generate synthetic TPP tables for load-testing the dataset definitions
+#
+# Usage (from the repository root):
+#   python analysis/local_pipeline/synthetic_data.py --patients 1000000 [--seed 1]
+#       [--chunk-size 100000] [--format parquet|arrow] [--output-dir DIR]
+#
+# Writes one file per table (patients, practice_registrations, addresses, clinical_events,
+# medications, apcs, vaccinations, ons_deaths, sgss_covid_all_tests, emergency_care_attendances,
+# appointments, ethnicity_from_sus and occupation_on_covid_vaccine_record) to
+# output/local_pipeline/synthetic/<patients>/ by default.
+# Clinical codes are drawn from the codelists declared in codelists.py, mixed with
+# codes that are in no codelist, so that codelist filters select a realistic share
+# of events. Patients are generated in chunks of --chunk-size, so memory use does
+# not grow with the population; the output is deterministic for a given seed and
+# chunk size. Use --format arrow to write files that ehrQL can read with --dummy-tables.
+#
+# Requires numpy and pyarrow.
+
+import argparse
+import csv
+import os
+import re
+import sys
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dataset_definition"))
+from codelists import codelist_specs  # noqa: E402
+
+# Parameters of the synthetic population --------------------------------------------------------
+
+study_start = np.datetime64("2015-01-01")
+study_end = np.datetime64("2024-12-31")
+pandemic_start = np.datetime64("2020-01-01")
+vax_start = np.datetime64("2020-12-08")
+
+regions = [
+    "North East", "North West", "Yorkshire and The Humber", "East Midlands", "West Midlands",
+    "East", "London", "South East", "South West",
+]
+
+vaccine_products = [
+    "COVID-19 mRNA Vaccine Comirnaty 30micrograms/0.3ml dose conc for susp for inj MDV (Pfizer)",
+    "COVID-19 Vaccine Vaxzevria 0.5ml inj multidose vials (AstraZeneca)",
+    "COVID-19 mRNA Vaccine Spikevax (nucleoside modified) 0.1mg/0.5mL dose disp for inj MDV (Moderna)",
+]
+
+# Mean number of rows per patient for each event table
+events_per_patient = dict(
+    clinical_events=40.0,
+    medications=20.0,
+    apcs=0.3,
+    sgss_covid_all_tests=1.0,
+    emergency_care_attendances=0.2,
+    appointments=5.0,
+)
+
+appointment_statuses = [
+    "Booked", "Arrived", "Did Not Attend", "In Progress", "Finished", "Requested", "Blocked",
+    "Visit", "Waiting", "Cancelled by Patient", "Cancelled by Unit", "Cancelled by Other Service",
+    "No Access Visit", "Cancelled Due To Death", "Patient Walked Out",
+]
+
+# SUS ethnic category codes (16 groups, as in get_latest_ethnicity) and codes for not stated
+sus_ethnicity_codes = ["A", "B", "C", "D", "E", "F", "G", "H", "J", "K", "L", "M", "N", "P", "R", "S", "Z", "99"]
+
+# Share of events whose code is in no codelist
+noise_fraction = 0.7
+
+# Code pools ------------------------------------------------------------------------------------
+
+# Code system of a codelist, from its name, code column and the shape of its codes
+def code_system(name, column, codes):
+    if "ctv3" in column.lower() or "ctv3" in name:
+        return "ctv3"
+    if all(re.match(r"^[A-Z][0-9]{2}[0-9X]?$", code) for code in codes):
+        return "icd10"
+    if "dmd" in name or name.endswith("rx_primis"):
+        return "dmd"
+    return "snomed"
+
+def read_codes(filename, column):
+    with open(filename, newline="") as f:
+        return [row[column].strip() for row in csv.DictReader(f) if row[column].strip()]
+
+# Pool of codes for each code system: all codes from the codelists plus unrelated codes
+def code_pools(rng):
+    pools = dict(snomed=set(), ctv3=set(), icd10=set(), dmd=set())
+    for name, spec in codelist_specs.items():
+        codes = read_codes(spec["filename"], spec["column"])
+        pools[code_system(name, spec["column"], codes)].update(codes)
+    noise = dict(
+        snomed=[str(code) for code in rng.integers(10**8, 10**9, 5000)],
+        ctv3=[f"X{code:04d}" for code in range(2000)],
+        icd10=[f"Z{code:02d}" for code in range(100)],
+        dmd=[str(code) for code in rng.integers(10**10, 10**11, 5000)],
+    )
+    return {
+        system: (np.array(sorted(codes), dtype=object), np.array(noise[system], dtype=object))
+        for system, codes in pools.items()
+    }
+
+def draw_codes(rng, pool, n):
+    codelist_codes, noise_codes = pool
+    from_codelist = rng.random(n) >= noise_fraction
+    codes = noise_codes[rng.integers(0, len(noise_codes), n)]
+    codes[from_codelist] = codelist_codes[rng.integers(0, len(codelist_codes), from_codelist.sum())]
+    return codes
+
+def draw_dates(rng, n, start=study_start, end=study_end):
+    days = (end - start).astype(int)
+    return start + rng.integers(0, days + 1, n).astype("timedelta64[D]")
+
+# Codes are object arrays: type them as strings, so that a chunk with only nulls keeps the schema
+def nullable(values, is_null):
+    return pa.array(values, mask=is_null, type=pa.string() if values.dtype == object else None)
+
+# Tables ----------------------------------------------------------------------------------------
+
+def generate_chunk(rng, pools, patient_ids):
+    n = len(patient_ids)
+    tables = {}
+
+    # patients
+    age_days = rng.integers(0, 100 * 365, n).astype("timedelta64[D]")
+    date_of_birth = (study_end - age_days).astype("datetime64[M]").astype("datetime64[D]")
+    dead = rng.random(n) < 0.03
+    date_of_death = draw_dates(rng, n, pandemic_start)
+    tables["patients"] = pa.table(dict(
+        patient_id=patient_ids,
+        date_of_birth=date_of_birth,
+        sex=rng.choice(np.array(["female", "male", "intersex", "unknown"]), n, p=[0.5, 0.49, 0.005, 0.005]),
+        date_of_death=nullable(date_of_death, ~dead),
+    ))
+
+    # practice_registrations (one or two per patient)
+    n_regs = rng.integers(1, 3, n)
+    reg_ids = np.repeat(patient_ids, n_regs)
+    start_date = draw_dates(rng, len(reg_ids), np.datetime64("1990-01-01"), np.datetime64("2018-12-31"))
+    ended = rng.random(len(reg_ids)) < 0.1
+    tables["practice_registrations"] = pa.table(dict(
+        patient_id=reg_ids,
+        start_date=start_date,
+        end_date=nullable(draw_dates(rng, len(reg_ids), np.datetime64("2020-01-01")), ~ended),
+        practice_pseudo_id=rng.integers(1, 7000, len(reg_ids)),
+        practice_nuts1_region_name=rng.choice(np.array(regions), len(reg_ids)),
+    ))
+
+    # addresses (one or two per patient, with the most recent open-ended)
+    n_addresses = rng.integers(1, 3, n)
+    address_ids = np.repeat(patient_ids, n_addresses)
+    address_start = draw_dates(rng, len(address_ids), np.datetime64("1990-01-01"), np.datetime64("2021-12-31"))
+    is_last = np.arange(len(address_ids)) == np.repeat(np.cumsum(n_addresses) - 1, n_addresses)
+    care_home = rng.random(len(address_ids)) < 0.01
+    tables["addresses"] = pa.table(dict(
+        patient_id=address_ids,
+        address_id=np.arange(len(address_ids)) + int(patient_ids[0]) * 10,
+        start_date=address_start,
+        end_date=nullable(address_start + rng.integers(30, 3650, len(address_ids)).astype("timedelta64[D]"), is_last),
+        address_type=rng.integers(0, 4, len(address_ids)),
+        rural_urban_classification=rng.integers(1, 9, len(address_ids)),
+        imd_rounded=rng.integers(0, 329, len(address_ids)) * 100,
+        msoa_code=np.array([f"E0200{code:04d}" for code in rng.integers(0, 7000, len(address_ids))], dtype=object),
+        has_postcode=rng.random(len(address_ids)) < 0.98,
+        care_home_is_potential_match=care_home,
+        care_home_requires_nursing=care_home & (rng.random(len(address_ids)) < 0.5),
+        care_home_does_not_require_nursing=care_home & (rng.random(len(address_ids)) < 0.5),
+    ))
+
+    def event_patients(table):
+        counts = rng.poisson(events_per_patient[table], n)
+        return np.repeat(patient_ids, counts)
+
+    # clinical_events (each event is coded in SNOMED CT or CTV3)
+    ids = event_patients("clinical_events")
+    is_ctv3 = rng.random(len(ids)) < 0.2
+    has_value = rng.random(len(ids)) < 0.05
+    tables["clinical_events"] = pa.table(dict(
+        patient_id=ids,
+        date=draw_dates(rng, len(ids)),
+        snomedct_code=nullable(draw_codes(rng, pools["snomed"], len(ids)), is_ctv3),
+        ctv3_code=nullable(draw_codes(rng, pools["ctv3"], len(ids)), ~is_ctv3),
+        numeric_value=nullable(rng.uniform(15, 50, len(ids)).round(1), ~has_value),
+    ))
+
+    # medications
+    ids = event_patients("medications")
+    tables["medications"] = pa.table(dict(
+        patient_id=ids,
+        date=draw_dates(rng, len(ids)),
+        dmd_code=draw_codes(rng, pools["dmd"], len(ids)),
+    ))
+
+    # apcs
+    ids = event_patients("apcs")
+    admission_date = draw_dates(rng, len(ids))
+    diagnoses = [draw_codes(rng, pools["icd10"], len(ids)) for _ in range(3)]
+    tables["apcs"] = pa.table(dict(
+        patient_id=ids,
+        admission_date=admission_date,
+        discharge_date=admission_date + rng.integers(0, 21, len(ids)).astype("timedelta64[D]"),
+        primary_diagnosis=diagnoses[0],
+        secondary_diagnosis=diagnoses[1],
+        all_diagnoses=pc.binary_join_element_wise(*[pa.array(codes) for codes in diagnoses], "||"),
+    ))
+
+    # vaccinations (0 to 4 doses, 8 to 16 weeks apart)
+    n_doses = rng.choice(5, n, p=[0.2, 0.05, 0.25, 0.4, 0.1])
+    ids = np.repeat(patient_ids, n_doses)
+    dose = np.arange(len(ids)) - np.repeat(np.cumsum(n_doses) - n_doses, n_doses)
+    first_dose = np.repeat(draw_dates(rng, n, vax_start, np.datetime64("2021-07-31")), n_doses)
+    gaps = rng.integers(56, 113, len(ids)) * dose
+    tables["vaccinations"] = pa.table(dict(
+        patient_id=ids,
+        vaccination_id=np.arange(len(ids)) + int(patient_ids[0]) * 10,
+        date=first_dose + gaps.astype("timedelta64[D]"),
+        target_disease=np.full(len(ids), "SARS-2 CORONAVIRUS", dtype=object),
+        product_name=rng.choice(np.array(vaccine_products, dtype=object), len(ids)),
+    ))
+
+    # ons_deaths (most deaths recorded in primary care are also registered with ONS)
+    registered = dead & (rng.random(n) < 0.9)
+    ids = patient_ids[registered]
+    causes = {"underlying_cause_of_death": draw_codes(rng, pools["icd10"], len(ids))}
+    for i in range(1, 16):
+        causes[f"cause_of_death_{i:02d}"] = nullable(
+            draw_codes(rng, pools["icd10"], len(ids)), rng.random(len(ids)) >= 0.5 / i
+        )
+    tables["ons_deaths"] = pa.table(dict(patient_id=ids, date=date_of_death[registered], **causes))
+
+    # sgss_covid_all_tests
+    ids = event_patients("sgss_covid_all_tests")
+    tables["sgss_covid_all_tests"] = pa.table(dict(
+        patient_id=ids,
+        specimen_taken_date=draw_dates(rng, len(ids), pandemic_start, np.datetime64("2022-12-31")),
+        is_positive=rng.random(len(ids)) < 0.3,
+    ))
+
+    # emergency_care_attendances (one to three diagnoses per attendance)
+    ids = event_patients("emergency_care_attendances")
+    n_diagnoses = rng.integers(1, 4, len(ids))
+    ec = dict(
+        patient_id=ids,
+        id=np.arange(len(ids)) + int(patient_ids[0]) * 10,
+        arrival_date=draw_dates(rng, len(ids)),
+        discharge_destination=draw_codes(rng, pools["snomed"], len(ids)),
+    )
+    for i in range(1, 25):
+        ec[f"diagnosis_{i:02d}"] = nullable(draw_codes(rng, pools["snomed"], len(ids)), n_diagnoses < i)
+    tables["emergency_care_attendances"] = pa.table(ec)
+
+    # appointments
+    ids = event_patients("appointments")
+    booked_date = draw_dates(rng, len(ids), np.datetime64("2018-01-01"))
+    start_date = booked_date + rng.integers(0, 29, len(ids)).astype("timedelta64[D]")
+    status = rng.choice(np.array(appointment_statuses, dtype=object), len(ids))
+    tables["appointments"] = pa.table(dict(
+        patient_id=ids,
+        booked_date=booked_date,
+        start_date=start_date,
+        seen_date=nullable(start_date, ~np.isin(status, ["Arrived", "In Progress", "Finished", "Visit"])),
+        status=status,
+    ))
+
+    # ethnicity_from_sus (one row per patient with a recorded ethnic category)
+    recorded = rng.random(n) < 0.6
+    tables["ethnicity_from_sus"] = pa.table(dict(
+        patient_id=patient_ids[recorded],
+        code=rng.choice(np.array(sus_ethnicity_codes, dtype=object), recorded.sum()),
+    ))
+
+    # occupation_on_covid_vaccine_record (recorded at vaccination)
+    ids = patient_ids[(n_doses > 0) & (rng.random(n) < 0.5)]
+    tables["occupation_on_covid_vaccine_record"] = pa.table(dict(
+        patient_id=ids,
+        is_healthcare_worker=rng.random(len(ids)) < 0.05,
+    ))
+
+    return tables
+
+# Writers ---------------------------------------------------------------------------------------
+
+class TableWriters:
+    def __init__(self, output_dir, file_format):
+        self.output_dir = output_dir
+        self.file_format = file_format
+        self.writers = {}
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, name, table):
+        if name not in self.writers:
+            path = os.path.join(self.output_dir, f"{name}.{self.file_format}")
+            if self.file_format == "parquet":
+                self.writers[name] = pq.ParquetWriter(path, table.schema)
+            else:
+                self.writers[name] = pa.ipc.new_file(path, table.schema)
+        self.writers[name].write_table(table)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+def generate(patients, output_dir, seed=1, chunk_size=100_000, file_format="parquet"):
+    pools = code_pools(np.random.default_rng(seed))
+    writers = TableWriters(output_dir, file_format)
+    try:
+        for chunk, first_id in enumerate(range(1, patients + 1, chunk_size)):
+            rng = np.random.default_rng([seed, chunk])
+            patient_ids = np.arange(first_id, min(first_id + chunk_size, patients + 1), dtype=np.int64)
+            for name, table in generate_chunk(rng, pools, patient_ids).items():
+                writers.write(name, table)
+    finally:
+        writers.close()
+
+# Number of rows in each table of a generated dataset
+
+def table_sizes(output_dir):
+    sizes = {}
+    for filename in sorted(os.listdir(output_dir)):
+        name, ext = os.path.splitext(filename)
+        path = os.path.join(output_dir, filename)
+        if ext == ".parquet":
+            sizes[name] = pq.ParquetFile(path).metadata.num_rows
+        elif ext == ".arrow":
+            sizes[name] = feather.read_table(path, memory_map=True).num_rows
+    return sizes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic TPP tables")
+    parser.add_argument("--patients", type=int, required=True)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    parser.add_argument("--output-dir")
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or f"output/local_pipeline/synthetic/{args.patients}"
+    generate(args.patients, output_dir, args.seed, args.chunk_size, args.format)
+    for name, rows in table_sizes(output_dir).items():
+        print(f"{name:<30} {rows:>12} rows")
@@ -0,0 +1,120 @@
+import datetime
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+import timeline_store
+
+epoch = datetime.date(1970, 1, 1)
+codes = ["A", "B", "C", "D", "E"]
+
+
+def random_events(seed, rows=3000, patients=200):
+    rng = np.random.default_rng(seed)
+    dates = [
+        None if rng.random() < 0.05 else epoch + datetime.timedelta(days=int(day))
+        for day in rng.integers(17500, 19500, rows)
+    ]
+    snomedct_code = [None if rng.random() < 0.05 else codes[i] for i in rng.integers(0, len(codes), rows)]
+    ctv3_code = [codes[i] for i in rng.integers(0, len(codes), rows)]
+    return dict(
+        patient_id=[int(patient_id) for patient_id in rng.integers(1, patients * 3, rows)],
+        date=dates,
+        snomedct_code=snomedct_code,
+        ctv3_code=ctv3_code,
+    )
+
+
+@pytest.fixture
+def timeline(tmp_path):
+    events = random_events(0)
+    source = tmp_path / "source"
+    source.mkdir()
+    pq.write_table(pa.table(events), source / "clinical_events.parquet")
+    timeline_store.build(str(source), str(tmp_path / "timelines"), "clinical_events")
+    return timeline_store.Timeline(str(tmp_path / "timelines" / "clinical_events")), events
+
+
+# First and last matching date of each patient by scanning every event
+def brute_force(events, column, codelist, start, end):
+    first = {}
+    last = {}
+    for patient_id, date, code in zip(events["patient_id"], events["date"], events[column]):
+        if date is None or code not in codelist:
+            continue
+        day = (date - epoch).days
+        if (start is not None and day < start[patient_id]) or (end is not None and day > end[patient_id]):
+            continue
+        first[patient_id] = min(first.get(patient_id, day), day)
+        last[patient_id] = max(last.get(patient_id, day), day)
+    return first, last
+
+
+def as_days(patient_ids, dates):
+    return {
+        int(patient_id): int(date.astype(np.int64))
+        for patient_id, date in zip(patient_ids, dates)
+        if not np.isnat(date)
+    }
+
+
+def test_build_layout(timeline):
+    timeline, events = timeline
+    patient_ids = np.asarray(timeline.patient_ids)
+    offsets = np.asarray(timeline.offsets)
+    dates = np.asarray(timeline.dates)
+
+    assert np.all(np.diff(patient_ids) > 0)
+    assert offsets[-1] == sum(date is not None for date in events["date"])
+    assert np.all(np.diff(np.asarray(timeline.keys)) >= 0)
+    for i in range(len(patient_ids)):
+        assert np.all(np.diff(dates[offsets[i]:offsets[i + 1]]) >= 0)
+
+
+@pytest.mark.parametrize("column", ["snomedct_code", "ctv3_code"])
+@pytest.mark.parametrize("window", ["unbounded", "fixed", "per_patient"])
+def test_queries_match_brute_force(timeline, column, window):
+    timeline, events = timeline
+    patient_ids = np.asarray(timeline.patient_ids)
+    codelist = ["B", "D", "Z"]
+
+    if window == "unbounded":
+        start = end = None
+        start_by_patient = end_by_patient = None
+    elif window == "fixed":
+        start, end = 18000, 19000
+        start_by_patient = {int(p): start for p in patient_ids}
+        end_by_patient = {int(p): end for p in patient_ids}
+    else:
+        rng = np.random.default_rng(1)
+        start = rng.integers(17500, 19000, len(patient_ids))
+        end = start + rng.integers(0, 500, len(patient_ids))
+        start_by_patient = {int(p): int(s) for p, s in zip(patient_ids, start)}
+        end_by_patient = {int(p): int(e) for p, e in zip(patient_ids, end)}
+
+    expected_first, expected_last = brute_force(events, column, set(codelist), start_by_patient, end_by_patient)
+
+    assert as_days(patient_ids, timeline.first_date(column, codelist, start, end)) == expected_first
+    assert as_days(patient_ids, timeline.last_date(column, codelist, start, end)) == expected_last
+    exists = timeline.exists(column, codelist, start, end)
+    assert {int(p) for p in patient_ids[exists]} == set(expected_first)
+
+
+def test_no_matching_codes(timeline):
+    timeline, events = timeline
+    assert not timeline.exists("snomedct_code", ["Z"]).any()
+    assert np.isnat(timeline.first_date("snomedct_code", ["Z"])).all()
+
+
+def test_for_patients(timeline):
+    timeline, events = timeline
+    patient_ids = np.asarray(timeline.patient_ids)
+    exists = timeline.exists("snomedct_code", ["A"])
+    others = np.array([0, int(patient_ids[0]), int(patient_ids[-1]) + 1, int(patient_ids[-1])])
+
+    result = timeline.for_patients(others, exists, False)
+
+    assert result.tolist() == [False, bool(exists[0]), False, bool(exists[-1])]
@@ -0,0 +1,222 @@
+# Per-patient event timelines for first/last/exists-in-window queries
+#
+# Usage (from the repository root, with numpy and pyarrow installed):
+#   python analysis/local_pipeline/timeline_store.py build [--source DIR] [--output-dir DIR]
+#       [--tables clinical_events medications]
+#   python analysis/local_pipeline/timeline_store.py query <table> <code column> <codelist>
+#       [--start 2020-01-01] [--end 2021-12-31] [--store-dir DIR]
+#
+# build materialises each event table once in a patient-CSR layout, in
+# output/local_pipeline/timelines/<table>/ by default:
+#   patient_ids.npy   int64, the patients with events, in increasing order
+#   offsets.npy       int64, the events of patient i are rows offsets[i]:offsets[i + 1]
+#   keys.npy          int64, patient index * 2**32 + (date + 2**31): increasing over all rows
+#   dates.npy         int32, days since 1970-01-01, in date order within each patient
+#   <code column>.npy int32, the index of the row's code in <code column>.json (-1 if null)
+# Events without a date are left out, as they are never in a date window.
+#
+# A Timeline opens these files memory-mapped (read-only), so several cohort runs on one host share
+# one copy in the page cache. The helpers' "filter by codelist, filter by date window, sort by date,
+# take first/last" becomes, for all patients at once:
+#   - a bitmap over the code vocabulary for the codelist, probed with each row's code id;
+#   - binary searches of keys for each patient's window;
+#   - binary searches of the matching rows for the first or last one in each window.
+# Windows are inclusive, as is_on_or_between, and can differ by patient (e.g. an index date).
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+timelines_dir = "output/local_pipeline/timelines"
+
+# Code columns of each table
+table_code_columns = dict(
+    clinical_events=["snomedct_code", "ctv3_code"],
+    medications=["dmd_code"],
+)
+
+date_bias = 2**31
+patient_shift = 2**32
+
+# Building --------------------------------------------------------------------------------------
+
+def read_table(path, columns):
+    if path.endswith(".parquet"):
+        return pq.read_table(path, columns=columns)
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all().select(columns)
+
+def source_path(source_dir, table):
+    for ext in (".parquet", ".arrow"):
+        path = os.path.join(source_dir, f"{table}{ext}")
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No {table}.parquet or {table}.arrow in {source_dir}")
+
+# Codes as ids into a sorted vocabulary (-1 for null)
+def encode_codes(column):
+    encoded = pc.dictionary_encode(column).combine_chunks()
+    vocabulary = np.array(encoded.dictionary.to_pylist(), dtype=object)
+    order = np.argsort(vocabulary)
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order), dtype=np.int32)
+    indices = encoded.indices.to_numpy(zero_copy_only=False)
+    ids = np.full(len(encoded), -1, dtype=np.int32)
+    valid = encoded.is_valid().to_numpy(zero_copy_only=False)
+    ids[valid] = rank[indices[valid].astype(np.int64)]
+    return ids, vocabulary[order].tolist()
+
+def build(source_dir, output_dir, table):
+    code_columns = table_code_columns[table]
+    events = read_table(source_path(source_dir, table), ["patient_id", "date", *code_columns])
+    events = events.filter(pc.is_valid(events["date"]))
+
+    patient_id = events["patient_id"].to_numpy()
+    dates = pc.cast(events["date"], pa.int32()).to_numpy()
+    order = np.lexsort((dates, patient_id))
+    patient_id = patient_id[order]
+    dates = dates[order]
+
+    patient_ids, patient_index, counts = np.unique(patient_id, return_inverse=True, return_counts=True)
+    offsets = np.zeros(len(patient_ids) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    keys = patient_index.astype(np.int64) * patient_shift + (dates.astype(np.int64) + date_bias)
+
+    table_dir = os.path.join(output_dir, table)
+    os.makedirs(table_dir, exist_ok=True)
+    np.save(os.path.join(table_dir, "patient_ids.npy"), patient_ids.astype(np.int64))
+    np.save(os.path.join(table_dir, "offsets.npy"), offsets)
+    np.save(os.path.join(table_dir, "keys.npy"), keys)
+    np.save(os.path.join(table_dir, "dates.npy"), dates.astype(np.int32))
+    for column in code_columns:
+        ids, vocabulary = encode_codes(events[column])
+        np.save(os.path.join(table_dir, f"{column}.npy"), ids[order])
+        with open(os.path.join(table_dir, f"{column}.json"), "w") as f:
+            json.dump(vocabulary, f)
+    return len(patient_ids), len(dates)
+
+# Querying --------------------------------------------------------------------------------------
+
+def day_number(value):
+    return int(np.datetime64(value, "D").astype(np.int64))
+
+def to_dates(days, found):
+    result = np.full(len(days), np.datetime64("NaT"), dtype="datetime64[D]")
+    result[found] = days[found].astype("datetime64[D]")
+    return result
+
+class Timeline:
+    def __init__(self, table_dir):
+        self.table_dir = table_dir
+        self.patient_ids = np.load(os.path.join(table_dir, "patient_ids.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(table_dir, "offsets.npy"), mmap_mode="r")
+        self.keys = np.load(os.path.join(table_dir, "keys.npy"), mmap_mode="r")
+        self.dates = np.load(os.path.join(table_dir, "dates.npy"), mmap_mode="r")
+        self.codes = {}
+        self.vocabularies = {}
+
+    def code_ids(self, column):
+        if column not in self.codes:
+            self.codes[column] = np.load(os.path.join(self.table_dir, f"{column}.npy"), mmap_mode="r")
+            with open(os.path.join(self.table_dir, f"{column}.json")) as f:
+                self.vocabularies[column] = {code: i for i, code in enumerate(json.load(f))}
+        return self.codes[column]
+
+    # Bitmap over the code vocabulary of a column: True for the codes in the codelist
+    def code_set(self, column, codelist):
+        self.code_ids(column)
+        vocabulary = self.vocabularies[column]
+        bitmap = np.zeros(len(vocabulary) + 1, dtype=bool)  # the last entry is for null codes (-1)
+        bitmap[[vocabulary[code] for code in codelist if code in vocabulary]] = True
+        return bitmap
+
+    # Rows of the events matching a codelist, in increasing order
+    def matching_rows(self, column, codelist):
+        return np.flatnonzero(self.code_set(column, codelist)[self.code_ids(column)])
+
+    # Rows [lo, hi) of each patient's events between start and end (inclusive, None for unbounded)
+    def window(self, start=None, end=None):
+        patients = np.arange(len(self.patient_ids), dtype=np.int64) * patient_shift
+        if start is None:
+            lo = np.asarray(self.offsets[:-1])
+        else:
+            lo = np.searchsorted(self.keys, patients + (np.asarray(start, dtype=np.int64) + date_bias), "left")
+        if end is None:
+            hi = np.asarray(self.offsets[1:])
+        else:
+            hi = np.searchsorted(self.keys, patients + (np.asarray(end, dtype=np.int64) + date_bias), "right")
+        return lo, hi
+
+    # First and last matching row in each patient's window, with whether there is one
+    def first_row(self, rows, lo, hi):
+        if len(rows) == 0:
+            return np.zeros(len(lo), dtype=np.int64), np.zeros(len(lo), dtype=bool)
+        i = np.minimum(np.searchsorted(rows, lo, "left"), len(rows) - 1)
+        return rows[i], (rows[i] >= lo) & (rows[i] < hi)
+
+    def last_row(self, rows, lo, hi):
+        if len(rows) == 0:
+            return np.zeros(len(lo), dtype=np.int64), np.zeros(len(lo), dtype=bool)
+        i = np.maximum(np.searchsorted(rows, hi, "left") - 1, 0)
+        return rows[i], (rows[i] >= lo) & (rows[i] < hi)
+
+    # Date of each patient's first matching event in the window (NaT if none), aligned with patient_ids
+    def first_date(self, column, codelist, start=None, end=None):
+        row, found = self.first_row(self.matching_rows(column, codelist), *self.window(start, end))
+        return to_dates(np.asarray(self.dates)[row], found)
+
+    def last_date(self, column, codelist, start=None, end=None):
+        row, found = self.last_row(self.matching_rows(column, codelist), *self.window(start, end))
+        return to_dates(np.asarray(self.dates)[row], found)
+
+    def exists(self, column, codelist, start=None, end=None):
+        return self.first_row(self.matching_rows(column, codelist), *self.window(start, end))[1]
+
+    # Values for other patients (e.g. a cohort's population) from values aligned with patient_ids
+    def for_patients(self, patient_ids, values, missing):
+        i = np.searchsorted(self.patient_ids, patient_ids)
+        i = np.minimum(i, len(self.patient_ids) - 1)
+        known = np.asarray(self.patient_ids)[i] == patient_ids
+        result = np.full(len(patient_ids), missing, dtype=values.dtype)
+        result[known] = values[i[known]]
+        return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-patient event timelines")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument("--source", default="output/local_pipeline/synthetic/100000")
+    build_parser.add_argument("--output-dir", default=timelines_dir)
+    build_parser.add_argument("--tables", nargs="+", choices=list(table_code_columns), default=list(table_code_columns))
+    query_parser = subparsers.add_parser("query")
+    query_parser.add_argument("table", choices=list(table_code_columns))
+    query_parser.add_argument("column")
+    query_parser.add_argument("codelist", help="a codelist name from codelists.py")
+    query_parser.add_argument("--start")
+    query_parser.add_argument("--end")
+    query_parser.add_argument("--store-dir", default=timelines_dir)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        for table in args.tables:
+            patients, events = build(args.source, args.output_dir, table)
+            print(f"{table:<20} {patients:>10} patients {events:>12} events")
+    else:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dataset_definition"))
+        import codelists
+
+        timeline = Timeline(os.path.join(args.store_dir, args.table))
+        start = None if args.start is None else day_number(args.start)
+        end = None if args.end is None else day_number(args.end)
+        codelist = getattr(codelists, args.codelist)
+        first = timeline.first_date(args.column, codelist, start, end)
+        last = timeline.last_date(args.column, codelist, start, end)
+        print(f"{(~np.isnat(first)).sum()} of {len(first)} patients have a matching event")
+        if (~np.isnat(first)).any():
+            print(f"earliest first date {first[~np.isnat(first)].min()}, latest last date {last[~np.isnat(last)].max()}")